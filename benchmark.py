@@ -0,0 +1,282 @@
+import argparse
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from struct import iter_unpack
+from zk import ZK
+from zk.attendance import Attendance
+from zk_simulator import SimulatedDevice, DeviceSimulator
+from zk_reader import ZKTecoReader, decode_attendance
+from db import DatabaseHandler
+from ingest import IngestWriter
+from spool import Spool
+from supervisor import DeviceSupervisor
+from records import AttendanceRecord
+
+SERIAL_PREFIX = 'BENCH'
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class IngestBenchmark:
+    """Drives simulated terminals through ZKTecoReader and DatabaseHandler
+
+    Measures the startup backfill (device download and bulk insert) and then
+    the steady-state pipeline: punches generated on the simulators are
+    matched against rows appearing in zkt_attendance to get end-to-end
+    latency and throughput.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.simulators = []
+        self.readers = []
+        self.db_handler = DatabaseHandler()
+        # (device_serial, user_id, timestamp) -> monotonic time of the punch
+        self.punched = {}
+        self.landed = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def run(self):
+        if not self.db_handler.connect():
+            raise SystemExit("Failed to connect to database")
+        try:
+            self.start_devices()
+            self.reset_tables()
+            self.backfill()
+            self.live()
+        finally:
+            for simulator in self.simulators:
+                simulator.stop()
+            self.db_handler.disconnect()
+
+    def start_devices(self):
+        for index in range(self.args.devices):
+            device = SimulatedDevice(f"{SERIAL_PREFIX}{index + 1:07d}", users=self.args.users, records=self.args.records)
+            device.listeners.append(lambda record, serial=device.serial: self._on_punch(serial, record))
+            simulator = DeviceSimulator(device, self.args.host, self.args.port + index)
+            simulator.start()
+            self.simulators.append(simulator)
+
+            reader = ZKTecoReader(self.args.host, self.args.port + index, force_udp=self.args.udp, ommit_ping=True)
+            if not reader.connect():
+                raise SystemExit(f"Could not connect to simulated device on port {self.args.port + index}")
+            self.readers.append(reader)
+
+    def reset_tables(self):
+        with self.db_handler.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM zkt_attendance WHERE device_serial LIKE %s", (SERIAL_PREFIX + '%',))
+            cur.execute("DELETE FROM zkt_device_watermarks WHERE device_serial LIKE %s", (SERIAL_PREFIX + '%',))
+            conn.commit()
+        self.db_handler.watermarks.clear()
+
+    def backfill(self):
+        download_time = 0
+        write_time = 0
+        total = 0
+        for reader, simulator in zip(self.readers, self.simulators):
+            started = time.perf_counter()
+            logs = reader.get_attendance_logs()
+            download_time += time.perf_counter() - started
+
+            started = time.perf_counter()
+            self.db_handler.bulk_insert_attendance(logs, simulator.device.serial, len(logs))
+            write_time += time.perf_counter() - started
+            total += len(logs)
+
+        print(f"\nBackfill: {total} records from {len(self.readers)} devices")
+        print(f"  device download: {download_time:.2f}s ({total / max(download_time, 1e-9):.0f} records/s)")
+        print(f"  database write:  {write_time:.2f}s ({total / max(write_time, 1e-9):.0f} records/s)")
+
+    def live(self):
+        # A spool of its own: the production one may hold a running pusher's events
+        spool_dir = tempfile.mkdtemp(prefix='zkt-bench-spool-')
+        writer = IngestWriter(self.db_handler, spool=Spool(spool_dir))
+        writer.start()
+        supervisor = None
+        threads = []
+
+        if self.args.mode == 'supervisor':
+            supervisor = DeviceSupervisor(self.readers, writer, poll_interval=self.args.poll_interval)
+            threads.append(threading.Thread(target=supervisor.run, daemon=True))
+        else:
+            for reader in self.readers:
+                monitor = reader.monitor_hybrid_with_db if self.args.mode == 'hybrid' else reader.monitor_live_capture_with_db
+                threads.append(threading.Thread(target=monitor, args=(self.db_handler, writer), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        # Let live capture register before generating traffic
+        time.sleep(1)
+        watcher = threading.Thread(target=self._watch_database, daemon=True)
+        self.watching = True
+        watcher.start()
+
+        started = time.monotonic()
+        for simulator in self.simulators:
+            simulator.start_punching(self.args.rate)
+        time.sleep(self.args.duration)
+        for simulator in self.simulators:
+            simulator.stopping.set()
+        elapsed = time.monotonic() - started
+
+        # Give the pipeline time to drain what was generated
+        deadline = time.monotonic() + self.args.drain_timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.landed) >= len(self.punched):
+                    break
+            time.sleep(0.1)
+        self.watching = False
+        watcher.join()
+
+        if supervisor:
+            supervisor.stop()
+        for reader in self.readers:
+            reader.end_live_capture = True
+            if reader.conn:
+                reader.conn.end_live_capture = True
+        # Live capture only checks its stop flag between events, so wake it
+        # with one unrecorded punch instead of waiting out the socket timeout
+        for simulator in self.simulators:
+            simulator.device.listeners.clear()
+            if self.args.mode != 'supervisor':
+                simulator.device.punch()
+        for thread in threads:
+            thread.join(timeout=5)
+        writer.stop()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        self.report(elapsed)
+
+    def report(self, elapsed):
+        with self.lock:
+            latencies = [self.landed[key] - self.punched[key] for key in self.landed if key in self.punched]
+            generated = len(self.punched)
+        stored = len(latencies)
+
+        print(f"\nLive ({self.args.mode}): {generated} punches over {elapsed:.1f}s across {len(self.readers)} devices")
+        print(f"  stored:     {stored} ({generated - stored} missing)")
+        print(f"  throughput: {stored / max(elapsed, 1e-9):.1f} records/s")
+        print("  latency:    p50 {:.3f}s  p95 {:.3f}s  p99 {:.3f}s  max {:.3f}s".format(
+            percentile(latencies, 0.50), percentile(latencies, 0.95),
+            percentile(latencies, 0.99), max(latencies, default=0.0)
+        ))
+
+    def _on_punch(self, device_serial, record):
+        _, user_id, timestamp, _, _ = record
+        with self.lock:
+            self.punched[(device_serial, user_id, timestamp)] = time.monotonic()
+
+    def _watch_database(self):
+        """Poll for newly landed rows and stamp their arrival time"""
+        last_id = 0
+        while self.watching:
+            with self.db_handler.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, device_serial, user_id, timestamp FROM zkt_attendance
+                    WHERE id > %s AND device_serial LIKE %s
+                    ORDER BY id
+                """, (last_id, SERIAL_PREFIX + '%'))
+                rows = cur.fetchall()
+                conn.rollback()
+
+            now = time.monotonic()
+            with self.lock:
+                for row_id, device_serial, user_id, timestamp in rows:
+                    key = (device_serial, user_id, timestamp.replace(tzinfo=None))
+                    if key in self.punched:
+                        self.landed.setdefault(key, now)
+                    last_id = max(last_id, row_id)
+            time.sleep(self.args.watch_interval)
+
+def record_as_dict(attendance):
+    """The per-punch dict get_attendance_logs used to build"""
+    return {
+        'user_id': attendance.user_id,
+        'timestamp': attendance.timestamp,
+        'punch': attendance.punch,
+        'status': attendance.status,
+    }
+
+def benchmark_records(args):
+    """Compare decoding a device attendance buffer into dicts and into AttendanceRecord"""
+    data = SimulatedDevice(users=args.users, records=args.count).attendance_buffer()[4:]
+    decode_time = ZK('127.0.0.1')._ZK__decode_time
+
+    def as_dicts(data):
+        # pyzk's per-record Attendance objects, minus its quadratic re-slicing of the buffer
+        attendance = [
+            Attendance((user_id.split(b'\x00')[0]).decode(errors='ignore'), decode_time(timestamp), status, punch, uid)
+            for uid, user_id, status, timestamp, punch, space in iter_unpack('<H24sB4sB8s', data)
+        ]
+        return [record_as_dict(record) for record in attendance]
+
+    print(f"\nDecoding {args.count} attendance records (best of {args.repeat})")
+    variants = (
+        ('dict', as_dicts),
+        ('AttendanceRecord', lambda data: decode_attendance(data, decode_time)),
+    )
+    for name, convert in variants:
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            logs = convert(data)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+            del logs
+
+        # Measured separately so tracing does not skew the timing
+        tracemalloc.start()
+        logs = convert(data)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del logs
+
+        print(
+            f"  {name:<17} {best:.3f}s ({best / args.count * 1e9:.0f} ns/record), "
+            f"{retained / 1024 / 1024:.1f} MB kept ({retained / args.count:.0f} bytes/record), "
+            f"{peak / 1024 / 1024:.1f} MB peak"
+        )
+
+def main():
+    logging.basicConfig(
+        level=logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Benchmarks for the ZKTeco data pusher")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help="end-to-end ingest against simulated terminals and the configured database")
+    ingest.add_argument('--host', default='127.0.0.1')
+    ingest.add_argument('--port', type=int, default=14370, help="port of the first simulated device")
+    ingest.add_argument('--udp', action='store_true', help="talk to the simulators over UDP")
+    ingest.add_argument('--devices', type=int, default=4)
+    ingest.add_argument('--users', type=int, default=200, help="enrolled users per device")
+    ingest.add_argument('--records', type=int, default=20000, help="attendance records preloaded per device")
+    ingest.add_argument('--rate', type=float, default=20, help="punches per second per device during the live phase")
+    ingest.add_argument('--duration', type=float, default=10, help="seconds of live traffic")
+    ingest.add_argument('--mode', choices=['live', 'hybrid', 'supervisor'], default='live')
+    ingest.add_argument('--poll-interval', type=float, default=None, help="fixed supervisor poll interval (default: adaptive per device)")
+    ingest.add_argument('--watch-interval', type=float, default=0.02, help="how often landed rows are checked")
+    ingest.add_argument('--drain-timeout', type=float, default=10)
+
+    records = commands.add_parser('records', help="memory and conversion time of the attendance record type")
+    records.add_argument('--count', type=int, default=200000, help="records to convert")
+    records.add_argument('--users', type=int, default=500)
+    records.add_argument('--repeat', type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == 'records':
+        benchmark_records(args)
+    else:
+        IngestBenchmark(args).run()
+
+if __name__ == "__main__":
+    main()
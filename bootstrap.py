@@ -0,0 +1,80 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import BOOTSTRAP_MAX_WORKERS
+
+class DeviceBootstrap:
+    """Startup sync that downloads from all devices at once
+
+    A bounded pool connects to each device, syncs its users and stores the
+    attendance logged since the last run's watermark (streaming the whole log
+    chunk by chunk when there is none), all devices in parallel. Cold start
+    then takes about as long as the slowest device rather than the sum of all.
+    """
+
+    def __init__(self, readers, db_handler, max_workers=BOOTSTRAP_MAX_WORKERS):
+        self.readers = readers
+        self.db_handler = db_handler
+        self.max_workers = max_workers
+        # ip:port -> phase timings in seconds plus the outcome for each device
+        self.timings = {self._key(reader): {} for reader in readers}
+        self.logger = logging.getLogger(__name__)
+
+    def run(self):
+        """Sync every device and return the readers that connected"""
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bootstrap") as executor:
+            futures = {executor.submit(self._sync, reader): reader for reader in self.readers}
+            for future in as_completed(futures):
+                reader = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    self.timings[self._key(reader)]['error'] = str(e)
+                    self.logger.error(f"Startup sync failed for device {self._key(reader)}: {str(e)}")
+
+        self.report(time.monotonic() - started)
+        # A device that connected but failed to sync is still monitored
+        return [reader for reader in self.readers if reader.conn]
+
+    def report(self, elapsed):
+        print(f"\nStartup sync of {len(self.readers)} devices took {elapsed:.1f}s")
+        for key, timing in self.timings.items():
+            if timing.get('standby'):
+                print(f"  {key}: standing by, claimed by another node")
+                continue
+            if 'error' in timing:
+                print(f"  {key}: failed after {timing.get('connect', 0):.1f}s ({timing['error']})")
+                continue
+            print(
+                f"  {key} ({timing['serial']}): {timing['records']} records, "
+                f"connect {timing['connect']:.1f}s, users {timing['users']:.1f}s, "
+                f"attendance {timing['attendance']:.1f}s"
+            )
+
+    def _sync(self, reader):
+        timing = self.timings[self._key(reader)]
+        if not reader.acquire_lease():
+            timing['standby'] = True
+            return
+
+        phase_started = time.monotonic()
+        if not reader.ensure_connected():
+            timing['connect'] = time.monotonic() - phase_started
+            raise Exception("Could not connect to device")
+        device_info = reader.get_device_info()
+        device_serial = device_info if device_info else reader.ip
+        timing['serial'] = device_serial
+        timing['connect'] = time.monotonic() - phase_started
+
+        phase_started = time.monotonic()
+        reader.sync_users(self.db_handler)
+        timing['users'] = time.monotonic() - phase_started
+
+        phase_started = time.monotonic()
+        timing['records'] = reader.catch_up(self.db_handler, device_serial)
+        timing['attendance'] = time.monotonic() - phase_started
+
+    def _key(self, reader):
+        return f"{reader.ip}:{reader.port}"
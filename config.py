@@ -6,8 +6,136 @@ DB_CONFIG = {
     'port': 5432
 }
 
-# List of ZKTeco devices
+# Time zone of the devices' clocks. Device timestamps carry no zone, so every
+# database session uses this one to store, compare and bucket them. On an
+# existing database set it to the server's TimeZone (SHOW timezone) and don't
+# change it afterwards, or stored punches stop matching the device's
+DB_TIMEZONE = 'UTC'
+
+# Connection pool: every database operation checks out its own connection,
+# so device threads and the writer can run concurrently
+DB_POOL_ENABLED = True
+DB_POOL_MIN = 1
+DB_POOL_MAX = 10
+# Ping pooled connections idle longer than this (seconds) before reusing them
+DB_POOL_PING_AFTER = 30
+
+# Rows per multi-row INSERT statement when bulk saving attendance
+BULK_INSERT_PAGE_SIZE = 1000
+
+# Users whose (name, privilege, card) is unchanged since the last sync are not
+# sent to the database; every interval (seconds) a full sync heals any drift
+USER_CACHE_RECONCILE_INTERVAL = 3600
+
+# Device users are re-read and synced every interval (seconds) while monitoring;
+# live capture pauses for it and also reads the records logged meanwhile
+USER_SYNC_INTERVAL = 900
+
+# Records per chunk when a full device log is streamed into the database
+STREAM_CHUNK_SIZE = 5000
+
+# Consistency checks compare per-bucket ('day' or 'hour') record digests of
+# each device and the database, repairing only the buckets that differ. Every
+# RECONCILE_INTERVAL seconds the last RECONCILE_RECENT_BUCKETS buckets are
+# checked from a tail read starting at the first record of the oldest one;
+# every RECONCILE_FULL_INTERVAL seconds the whole device log is downloaded
+RECONCILE_BUCKET = 'day'
+RECONCILE_INTERVAL = 300
+RECONCILE_RECENT_BUCKETS = 2
+RECONCILE_FULL_INTERVAL = 24 * 3600
+
+# Maintenance of a monthly partitioned zkt_attendance (schema_partitioned.sql):
+# partitions are created PARTITION_PREMAKE_MONTHS ahead, months older than
+# PARTITION_RETENTION_MONTHS are dropped (0 keeps everything) and each month
+# is hash sub-partitioned by device into PARTITION_DEVICE_BUCKETS (0 disables)
+PARTITION_PREMAKE_MONTHS = 2
+PARTITION_RETENTION_MONTHS = 0
+PARTITION_DEVICE_BUCKETS = 0
+PARTITION_MAINTENANCE_INTERVAL = 6 * 3600
+
+# Every write transaction that inserts attendance rows publishes a NOTIFY on
+# this channel per device with the new id range; see notifications.py
+NOTIFY_ENABLED = True
+NOTIFY_CHANNEL = 'zkt_attendance'
+
+# Downstream work queue over zkt_attendance.status: rows claimed per
+# claim_pending() call, and seconds before an unacked claim is requeued
+QUEUE_CLAIM_BATCH_SIZE = 500
+QUEUE_CLAIM_TIMEOUT = 300
+
+# Rows per transaction when migrate.py backfills the native timestamp column
+MIGRATION_BATCH_SIZE = 10000
+
+# Live event ingest: device threads feed a bounded queue that one writer
+# thread flushes in a single transaction by size or by time (seconds)
+INGEST_QUEUE_SIZE = 10000
+INGEST_BATCH_SIZE = 500
+INGEST_FLUSH_INTERVAL = 0.2
+
+# Every live batch is fsynced to an on-disk spool before it is written to the
+# database. While the database is down batches only go to the spool, which is
+# replayed in SPOOL_REPLAY_BATCH sized transactions once a retry succeeds.
+SPOOL_ENABLED = True
+SPOOL_DIR = 'spool'
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024
+SPOOL_REPLAY_BATCH = 5000
+SPOOL_RETRY_INTERVAL = 5
+
+# Running the pusher on several hosts: each device is claimed by exactly one
+# node through a PostgreSQL session advisory lock (first key LEASE_NAMESPACE).
+# Other nodes stand by and retry every LEASE_RETRY_INTERVAL seconds, taking
+# over when the owner's session ends. The lease connection is checked every
+# LEASE_HEARTBEAT_INTERVAL seconds.
+LEASES_ENABLED = False
+LEASE_NAMESPACE = 4370
+LEASE_RETRY_INTERVAL = 10
+LEASE_HEARTBEAT_INTERVAL = 5
+
+# Worker processes the devices are spread over (round robin), so decoding scales
+# with cores. Each runs its own monitors, writer, database pool and spool
+# (SPOOL_DIR/shard-<n>) and serves metrics on METRICS_PORT + n; crashed workers
+# are restarted. 1 runs everything in a single process.
+SHARD_PROCESSES = 1
+
+# Devices downloaded in parallel during the startup sync
+BOOTSTRAP_MAX_WORKERS = 8
+
+# Prometheus text-format metrics served at http://<host>:METRICS_PORT/metrics
+METRICS_ENABLED = False
+METRICS_PORT = 9108
+
+# Lost devices are reconnected after RECONNECT_INITIAL_DELAY seconds, doubling
+# with random jitter up to RECONNECT_MAX_DELAY. After CIRCUIT_FAILURE_THRESHOLD
+# failures in a row a device's circuit opens: it is not contacted for
+# CIRCUIT_COOLDOWN seconds, then a single trial connect decides whether it closes
+RECONNECT_INITIAL_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 120
+
+# Polling (monitor_attendance_with_db and the supervisor): the delay drops to
+# POLL_MIN_INTERVAL whenever a poll finds new records and is multiplied by
+# POLL_BACKOFF after each idle poll, up to POLL_MAX_INTERVAL seconds
+POLL_MIN_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 30
+POLL_BACKOFF = 2
+
+# Device monitoring: 'live' runs a live-capture thread per device, 'hybrid'
+# adds gap filling to it, 'supervisor' polls every device from one asyncio
+# loop on a fixed-size thread pool
+MONITOR_MODE = 'live'
+# Hybrid mode pauses live capture after every (re)connect and every interval
+# (seconds) to read the records added to the device log since the last read,
+# recovering punches whose live events were lost
+GAP_FILL_INTERVAL = 300
+SUPERVISOR_MAX_WORKERS = 16
+SUPERVISOR_STATUS_INTERVAL = 60
+
+# List of ZKTeco devices. Optional keys: 'force_udp' to skip TCP,
+# 'ommit_ping' to skip the ICMP reachability check (e.g. for zk_simulator.py)
+# and 'poll' to override the poll schedule, e.g. {'min': 1, 'max': 300, 'backoff': 1.5}
 DEVICES = [
     # {'ip': '', 'port': 4370},
+    # {'ip': '127.0.0.1', 'port': 4370, 'ommit_ping': True},
     {'ip': '192.168.0.12', 'port': 4370},
 ]
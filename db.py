@@ -1,63 +1,232 @@
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
+from psycopg2.extras import execute_batch, execute_values
 import logging
-from config import DB_CONFIG
+import io
+import csv
+import json
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from metrics import DB_WRITE_SECONDS, DB_ROWS_WRITTEN, DB_ERRORS
+from config import (
+    DB_CONFIG, DB_TIMEZONE, BULK_INSERT_PAGE_SIZE, USER_CACHE_RECONCILE_INTERVAL,
+    DB_POOL_ENABLED, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_PING_AFTER,
+    NOTIFY_ENABLED, NOTIFY_CHANNEL, QUEUE_CLAIM_BATCH_SIZE, QUEUE_CLAIM_TIMEOUT
+)
+
+class _PinnedTimezoneConnection(psycopg2.extensions.connection):
+    """Connection whose session runs in DB_TIMEZONE, whatever PGTZ or role settings say"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self.cursor() as cur:
+            cur.execute("SET TIME ZONE %s", (DB_TIMEZONE,))
+        self.commit()
+
+def connect_params(**extra):
+    """psycopg2.connect() arguments for DB_CONFIG with the session time zone pinned"""
+    return dict(DB_CONFIG, connection_factory=_PinnedTimezoneConnection, **extra)
+
+# Rows taken by one claim_pending() call; claimed_at identifies the claim when acking
+Claim = namedtuple('Claim', 'claimed_at rows')
 
 class DatabaseHandler:
-    def __init__(self):
+    def __init__(self, pooled=DB_POOL_ENABLED):
+        self.pooled = pooled
         self.conn = None
+        self.pool = None
+        # Bounds checkouts so callers wait for a free connection instead of failing
+        self.pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+        # id(conn) -> monotonic time it was last returned to the pool
+        self.last_used = {}
+        # Serializes the single shared connection when not pooled
+        self.lock = threading.RLock()
         self.logger = logging.getLogger(__name__)
+        # device_serial -> (last_timestamp, last_record_count), mirrors zkt_device_watermarks
+        self.watermarks = {}
+        # user_id -> (name, privilege, card) last written, None for placeholders
+        self.user_fingerprints = {}
+        self.users_reconciled_at = None
+        self.users_lock = threading.Lock()
 
     def connect(self):
         try:
-            self.conn = psycopg2.connect(**DB_CONFIG)
-            self.logger.info("Successfully connected to database")
+            if self.pooled:
+                self.pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **connect_params())
+                self.logger.info(f"Successfully connected to database (pool of {DB_POOL_MIN}-{DB_POOL_MAX} connections)")
+            else:
+                self.conn = psycopg2.connect(**connect_params())
+                self.logger.info("Successfully connected to database")
             return True
         except Exception as e:
             self.logger.error(f"Database connection error: {str(e)}")
             return False
 
     def disconnect(self):
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+            self.logger.info("Database connection pool closed")
         if self.conn:
             self.conn.close()
             self.logger.info("Database connection closed")
 
+    @contextmanager
+    def connection(self):
+        """Check out a healthy connection for one operation, rolled back if the block raises"""
+        if self.pool is None:
+            with self.lock:
+                if self.conn is None or self.conn.closed:
+                    self.logger.warning("Database connection lost, reconnecting")
+                    self.conn = psycopg2.connect(**connect_params())
+                try:
+                    yield self.conn
+                except Exception:
+                    if not self.conn.closed:
+                        self.conn.rollback()
+                    raise
+            return
+
+        with self.pool_slots:
+            conn = self._checkout()
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self._checkin(conn, broken)
+
+    def _checkout(self):
+        """Get a pooled connection, replacing ones that fail the health check"""
+        for _ in range(DB_POOL_MAX + 1):
+            conn = self.pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            self.logger.warning("Discarding broken database connection")
+            self._checkin(conn, broken=True)
+        raise psycopg2.OperationalError("No healthy database connection available")
+
+    def _checkin(self, conn, broken=False):
+        broken = broken or bool(conn.closed)
+        if broken:
+            self.last_used.pop(id(conn), None)
+        else:
+            self.last_used[id(conn)] = time.monotonic()
+        self.pool.putconn(conn, close=broken)
+
+    @contextmanager
+    def _measure(self, operation):
+        """Record how long a write transaction took and whether it failed"""
+        try:
+            with DB_WRITE_SECONDS.labels(operation).time():
+                yield
+        except Exception:
+            DB_ERRORS.labels(operation).inc()
+            raise
+
+    def _is_healthy(self, conn):
+        if conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        # Only ping connections that sat idle long enough to have been dropped
+        idle_since = self.last_used.get(id(conn))
+        if idle_since is not None and time.monotonic() - idle_since < DB_POOL_PING_AFTER:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
     def ensure_tables(self):
         """Create tables if they don't exist"""
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
+                    -- Held until commit, so pushers starting together don't race on the DDL
+                    SELECT pg_advisory_xact_lock(hashtext('zkt_ensure_tables'));
+
                     CREATE TABLE IF NOT EXISTS zkt_users (
                         id SERIAL PRIMARY KEY,
                         user_id VARCHAR(50) UNIQUE,
-                        username VARCHAR(100)
+                        username VARCHAR(100),
+                        created_at TIMESTAMP DEFAULT NOW(),
+                        updated_at TIMESTAMP DEFAULT NOW()
                     );
 
+                    ALTER TABLE zkt_users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW();
+                    ALTER TABLE zkt_users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
+
                     CREATE TABLE IF NOT EXISTS zkt_attendance (
                         id SERIAL PRIMARY KEY,
                         user_id VARCHAR(50),
-                        timestamp TIMESTAMP,
+                        timestamp TIMESTAMPTZ,
                         device_serial VARCHAR(50),
                         UNIQUE (user_id, timestamp, device_serial)
                     );
 
+                    ALTER TABLE zkt_attendance ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW();
+                    ALTER TABLE zkt_attendance ADD COLUMN IF NOT EXISTS status VARCHAR(50) DEFAULT 'PENDING';
+                    ALTER TABLE zkt_attendance ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+
                     CREATE INDEX IF NOT EXISTS idx_zkt_attendance_user_id 
                     ON zkt_attendance(user_id);
                     
                     CREATE INDEX IF NOT EXISTS idx_zkt_attendance_timestamp 
                     ON zkt_attendance(timestamp);
+
+                    CREATE INDEX IF NOT EXISTS idx_zkt_attendance_device_timestamp
+                    ON zkt_attendance(device_serial, timestamp);
+
+                    -- migrate.py builds these concurrently on tables too large to lock
+                    CREATE INDEX IF NOT EXISTS idx_zkt_attendance_pending
+                    ON zkt_attendance(id) WHERE status = 'PENDING';
+
+                    CREATE INDEX IF NOT EXISTS idx_zkt_attendance_processing
+                    ON zkt_attendance(claimed_at) WHERE status = 'PROCESSING';
+
+                    CREATE TABLE IF NOT EXISTS zkt_device_watermarks (
+                        device_serial VARCHAR(150) PRIMARY KEY,
+                        last_timestamp TIMESTAMPTZ,
+                        last_record_count INTEGER DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT NOW()
+                    );
+
+                    -- Older installs kept a naive copy of the attendance TIMESTAMPTZ
+                    DO $$
+                    BEGIN
+                        IF EXISTS (
+                            SELECT 1 FROM information_schema.columns
+                            WHERE table_name = 'zkt_device_watermarks' AND column_name = 'last_timestamp'
+                            AND data_type = 'timestamp without time zone'
+                        ) THEN
+                            ALTER TABLE zkt_device_watermarks ALTER COLUMN last_timestamp TYPE TIMESTAMPTZ;
+                        END IF;
+                    END
+                    $$;
                 """)
-                self.conn.commit()
+                conn.commit()
                 return True
         except Exception as e:
             self.logger.error(f"Error ensuring tables: {str(e)}")
-            self.conn.rollback()
             return False
 
     def is_attendance_empty(self):
         """Check if attendance table is empty"""
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("SELECT COUNT(*) FROM zkt_attendance")
                 count = cur.fetchone()[0]
                 return count == 0
@@ -66,50 +235,147 @@ class DatabaseHandler:
             return True
 
     def sync_users(self, users):
-        """Sync users to database"""
-        try:
-            with self.conn.cursor() as cur:
-                # Prepare data for batch insert/update
-                user_data = [(user['user_id'], user['name']) for user in users]
-                
-                # Insert or update based on user_id
-                for user_id, username in user_data:
-                    cur.execute("""
-                        WITH upsert AS (
-                            UPDATE zkt_users 
-                            SET username = %s,
-                                updated_at = NOW()
-                            WHERE user_id = %s
-                            RETURNING *
-                        )
-                        INSERT INTO zkt_users (user_id, username, created_at, updated_at)
-                        SELECT %s, %s, NOW(), NOW()
-                        WHERE NOT EXISTS (SELECT * FROM upsert)
-                    """, (username, user_id, user_id, username))
-                
-                self.conn.commit()
-                self.logger.info(f"Successfully synced {len(users)} users")
-                return True
+        """Upsert new or changed users; returns (inserted, updated) or None"""
+        reconcile = False
+        try:
+            # A page may not touch the same row twice, so the last entry per id wins
+            fingerprints = {user['user_id']: self._user_fingerprint(user) for user in users}
+
+            with self.users_lock:
+                reconcile = (self.users_reconciled_at is None or
+                             time.monotonic() - self.users_reconciled_at >= USER_CACHE_RECONCILE_INTERVAL)
+                if reconcile:
+                    # Claimed now, so concurrent syncs neither reconcile too nor lose
+                    # each other's entries; placeholders are forgotten and re-checked
+                    self.users_reconciled_at = time.monotonic()
+                    self.user_fingerprints.clear()
+                else:
+                    fingerprints = {
+                        user_id: fingerprint for user_id, fingerprint in fingerprints.items()
+                        if self.user_fingerprints.get(user_id, False) != fingerprint
+                    }
+
+            if not fingerprints:
+                self.logger.debug(f"All {len(users)} users unchanged since last sync")
+                return 0, 0
+
+            # Sorting keeps lock order stable across concurrent syncs
+            user_data = sorted((user_id, fingerprint[0]) for user_id, fingerprint in fingerprints.items())
+
+            with self.connection() as conn, self._measure('sync_users'), conn.cursor() as cur:
+                rows = execute_values(cur, """
+                    INSERT INTO zkt_users (user_id, username, created_at, updated_at)
+                    VALUES %s
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET username = EXCLUDED.username,
+                        updated_at = NOW()
+                    WHERE zkt_users.username IS DISTINCT FROM EXCLUDED.username
+                    RETURNING (xmax = 0)
+                """, user_data, template="(%s, %s, NOW(), NOW())",
+                    page_size=BULK_INSERT_PAGE_SIZE, fetch=True)
+                conn.commit()
+
+            with self.users_lock:
+                self.user_fingerprints.update(fingerprints)
+
+            inserted = sum(1 for (is_insert,) in rows if is_insert)
+            updated = len(rows) - inserted
+            DB_ROWS_WRITTEN.labels('sync_users').inc(len(rows))
+            self.logger.info(f"Successfully synced {len(user_data)} users ({inserted} new, {updated} renamed)")
+            return inserted, updated
         except Exception as e:
             self.logger.error(f"Error syncing users: {str(e)}")
-            self.conn.rollback()
-            return False
+            if reconcile:
+                with self.users_lock:
+                    self.users_reconciled_at = None
+            return None
+
+    def _user_fingerprint(self, user):
+        return user['name'], user.get('privilege'), user.get('card')
 
     def get_latest_attendance_timestamp(self):
         """Get the latest attendance timestamp"""
         try:
-            with self.conn.cursor() as cur:
-                # Modified to handle string timestamp
-                cur.execute("SELECT MAX(CAST(timestamp AS timestamp)) FROM zkt_attendance")
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("SELECT MAX(timestamp) FROM zkt_attendance")
                 return cur.fetchone()[0]
         except Exception as e:
             self.logger.error(f"Error getting latest timestamp: {str(e)}")
             return None
 
+    def get_device_watermark(self, device_serial, cached=True):
+        """Get the (last_timestamp, last_record_count) high-water mark for a device"""
+        if cached and device_serial in self.watermarks:
+            return self.watermarks[device_serial]
+
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT last_timestamp, last_record_count FROM zkt_device_watermarks
+                    WHERE device_serial = %s
+                """, (device_serial,))
+                row = cur.fetchone()
+
+                if row is None:
+                    # First time we see this device, seed the mark from its stored rows;
+                    # its log position stays unknown (0) until the device is read
+                    cur.execute("""
+                        SELECT MAX(timestamp) FROM zkt_attendance
+                        WHERE device_serial = %s
+                    """, (device_serial,))
+                    last_timestamp = cur.fetchone()[0]
+                    row = self._set_watermark(cur, device_serial, last_timestamp, None, advance_only=False)
+                    conn.commit()
+
+                self.watermarks[device_serial] = tuple(row)
+                return self.watermarks[device_serial]
+        except Exception as e:
+            self.logger.error(f"Error getting watermark for device {device_serial}: {str(e)}")
+            return None, 0
+
+    def has_attendance(self, device_serial, record):
+        """Check whether a device record is already stored"""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT 1 FROM zkt_attendance
+                    WHERE user_id = %s AND timestamp = %s AND device_serial = %s
+                """, (record.user_id, record.timestamp, device_serial))
+                return cur.fetchone() is not None
+        except Exception as e:
+            self.logger.error(f"Error looking up attendance for device {device_serial}: {str(e)}")
+            return False
+
+    def _set_watermark(self, cur, device_serial, last_timestamp, record_count, advance_only=True):
+        """Upsert a device watermark inside the caller's transaction and return the stored row"""
+        if advance_only:
+            conflict_action = """
+                last_timestamp = GREATEST(zkt_device_watermarks.last_timestamp, EXCLUDED.last_timestamp),
+                last_record_count = COALESCE(%s, zkt_device_watermarks.last_record_count),
+            """
+            params = (device_serial, last_timestamp, record_count or 0, record_count)
+        else:
+            conflict_action = """
+                last_timestamp = EXCLUDED.last_timestamp,
+                last_record_count = EXCLUDED.last_record_count,
+            """
+            params = (device_serial, last_timestamp, record_count or 0)
+
+        cur.execute(f"""
+            INSERT INTO zkt_device_watermarks
+            (device_serial, last_timestamp, last_record_count, updated_at)
+            VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (device_serial) DO UPDATE SET
+                {conflict_action}
+                updated_at = NOW()
+            RETURNING last_timestamp, last_record_count
+        """, params)
+        return cur.fetchone()
+
     def get_attendance_count(self):
         """Get total number of attendance records in database"""
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("SELECT COUNT(*) FROM zkt_attendance")
                 return cur.fetchone()[0]
         except Exception as e:
@@ -119,7 +385,7 @@ class DatabaseHandler:
     def get_attendance_count_by_device(self, device_serial):
         """Get total number of attendance records for specific device"""
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     SELECT COUNT(*) FROM zkt_attendance 
                     WHERE device_serial = %s
@@ -129,101 +395,415 @@ class DatabaseHandler:
             self.logger.error(f"Error getting attendance count for device {device_serial}: {str(e)}")
             return 0
 
+    def get_attendance_bucket_digests(self, device_serial, bucket_format, since=None):
+        """Per-bucket (count, digest) of a device's stored attendance, or None on failure"""
+        try:
+            params = [bucket_format, device_serial]
+            since_filter = ""
+            if since is not None:
+                since_filter = "AND timestamp >= %s"
+                params.append(since)
+
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT to_char(timestamp, %s),
+                           COUNT(*),
+                           SUM(('x' || substr(md5(user_id || '|' || to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS')), 1, 15))::bit(60)::bigint)
+                    FROM zkt_attendance
+                    WHERE device_serial = %s
+                    {since_filter}
+                    GROUP BY 1
+                """, params)
+                return {bucket: (count, int(digest)) for bucket, count, digest in cur.fetchall()}
+        except Exception as e:
+            self.logger.error(f"Error getting attendance digests for device {device_serial}: {str(e)}")
+            return None
+
     def clear_attendance_table(self):
         """Clear all records from attendance table"""
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("TRUNCATE TABLE zkt_attendance")
-                self.conn.commit()
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("TRUNCATE TABLE zkt_attendance, zkt_device_watermarks")
+                conn.commit()
+                self.watermarks.clear()
                 self.logger.info("Cleared attendance table")
                 return True
         except Exception as e:
             self.logger.error(f"Error clearing attendance table: {str(e)}")
-            self.conn.rollback()
             return False
 
-    def save_attendance(self, records, device_serial):
+    def save_attendance(self, records, device_serial, record_count=None):
         """Save attendance records to database"""
         try:
-            # Try to save users if they exist
-            unique_users = list({
-                record['user_id']: {
-                    'user_id': record['user_id'],
-                    'name': f"User {record['user_id']}"
-                }
-                for record in records
-            }.values())
-
+            # Make sure every user exists without overwriting synced names
             try:
-                self.sync_users(unique_users)
+                with self.connection() as conn, self._measure('ensure_users'), conn.cursor() as cur:
+                    new_users = self._ensure_users(cur, {record.user_id for record in records})
+                    conn.commit()
+                self._remember_users(new_users)
             except Exception as e:
                 self.logger.warning(f"Could not sync users, continuing anyway: {str(e)}")
 
-            # Save attendance records in batches
-            with self.conn.cursor() as cur:
-                batch_size = 100
-                for i in range(0, len(records), batch_size):
-                    batch = records[i:i + batch_size]
-                    for record in batch:
-                        cur.execute("""
-                            INSERT INTO zkt_attendance 
-                            (user_id, timestamp, device_serial, status, created_at)
-                            SELECT %s, %s, %s, %s, NOW()
-                            WHERE NOT EXISTS (
-                                SELECT 1 FROM zkt_attendance 
-                                WHERE user_id = %s 
-                                AND timestamp = %s 
-                                AND device_serial = %s
-                            )
-                        """, (
-                            record['user_id'],            # INSERT user_id
-                            str(record['timestamp']),     # INSERT timestamp
-                            device_serial,                # INSERT device_serial
-                            'PENDING',                    # INSERT status
-                            record['user_id'],            # WHERE user_id
-                            str(record['timestamp']),     # WHERE timestamp
-                            device_serial                 # WHERE device_serial
-                        ))
-                    
-                self.conn.commit()
-                self.logger.info(f"Saved {len(records)} attendance records")
-                return True
-                
+            return self.bulk_insert_attendance(records, device_serial, record_count) is not None
+
         except Exception as e:
             self.logger.error(f"Error saving attendance: {str(e)}")
-            if self.conn:
-                self.conn.rollback()
             return False
 
+    def bulk_insert_attendance(self, records, device_serial, record_count=None):
+        """Bulk insert attendance records; returns (inserted, skipped) or None"""
+        try:
+            with self.connection() as conn, self._measure('bulk_insert_attendance'), conn.cursor() as cur:
+                inserted = self._insert_attendance_rows(cur, records, device_serial)
+                watermark = None
+                if records:
+                    last_timestamp = max(record.timestamp for record in records)
+                    watermark = self._set_watermark(cur, device_serial, last_timestamp, record_count)
+                conn.commit()
+
+            if watermark:
+                self.watermarks[device_serial] = tuple(watermark)
+
+            skipped = len(records) - inserted
+            DB_ROWS_WRITTEN.labels('bulk_insert_attendance').inc(inserted)
+            self.logger.info(f"Saved {inserted} attendance records for device {device_serial} ({skipped} already stored)")
+            return inserted, skipped
+        except Exception as e:
+            self.logger.error(f"Error bulk inserting attendance for device {device_serial}: {str(e)}")
+            return None
+
+    def save_attendance_stream(self, chunks, device_serial, record_count=None):
+        """Save an iterator of record chunks, one transaction per chunk; returns (inserted, skipped) or None"""
+        inserted = skipped = 0
+        try:
+            for records in chunks:
+                if not records:
+                    continue
+                with self.connection() as conn, self._measure('save_attendance_stream'), conn.cursor() as cur:
+                    new_users = self._ensure_users(cur, {record.user_id for record in records})
+                    chunk_inserted = self._insert_attendance_rows(cur, records, device_serial)
+                    last_timestamp = max(record.timestamp for record in records)
+                    watermark = self._set_watermark(cur, device_serial, last_timestamp, None)
+                    conn.commit()
+
+                self._remember_users(new_users)
+                self.watermarks[device_serial] = tuple(watermark)
+                DB_ROWS_WRITTEN.labels('save_attendance_stream').inc(chunk_inserted)
+                inserted += chunk_inserted
+                skipped += len(records) - chunk_inserted
+
+            if record_count is not None:
+                with self.connection() as conn, conn.cursor() as cur:
+                    watermark = self._set_watermark(cur, device_serial, None, record_count)
+                    conn.commit()
+                self.watermarks[device_serial] = tuple(watermark)
+
+            self.logger.info(f"Saved {inserted} streamed attendance records for device {device_serial} ({skipped} already stored)")
+            return inserted, skipped
+        except Exception as e:
+            self.logger.error(f"Error saving attendance stream for device {device_serial}: {str(e)}")
+            return None
+
+    def save_attendance_events(self, events):
+        """Save (device_serial, record) events from several devices in one transaction"""
+        try:
+            by_device = {}
+            for device_serial, record in events:
+                by_device.setdefault(device_serial, []).append(record)
+
+            watermarks = {}
+            with self.connection() as conn, self._measure('save_attendance_events'), conn.cursor() as cur:
+                new_users = self._ensure_users(cur, {record.user_id for _, record in events})
+
+                inserted = 0
+                for device_serial, records in by_device.items():
+                    inserted += self._insert_attendance_rows(cur, records, device_serial)
+                    last_timestamp = max(record.timestamp for record in records)
+                    watermarks[device_serial] = self._set_watermark(cur, device_serial, last_timestamp, None)
+
+                conn.commit()
+
+            self._remember_users(new_users)
+            DB_ROWS_WRITTEN.labels('save_attendance_events').inc(inserted)
+            for device_serial, watermark in watermarks.items():
+                self.watermarks[device_serial] = tuple(watermark)
+            self.logger.info(f"Saved {inserted} of {len(events)} attendance events from {len(by_device)} devices")
+            return True
+        except Exception as e:
+            self.logger.error(f"Error saving attendance events: {str(e)}")
+            return False
+
+    def claim_pending(self, limit=QUEUE_CLAIM_BATCH_SIZE, device_serial=None):
+        """Claim up to limit PENDING rows for a downstream processor, oldest first"""
+        try:
+            params = []
+            device_filter = ""
+            if device_serial is not None:
+                device_filter = "AND device_serial = %s"
+                params.append(device_serial)
+            params.append(limit)
+
+            # SKIP LOCKED lets processors claim concurrently without waiting on each other's rows
+            with self.connection() as conn, self._measure('claim_pending'), conn.cursor() as cur:
+                cur.execute(f"""
+                    WITH claimed AS (
+                        SELECT id FROM zkt_attendance
+                        WHERE status = 'PENDING'
+                        {device_filter}
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    UPDATE zkt_attendance a
+                    SET status = 'PROCESSING', claimed_at = NOW()
+                    FROM claimed c
+                    WHERE a.id = c.id
+                    RETURNING a.id, a.user_id, a.timestamp, a.device_serial, a.claimed_at
+                """, params)
+                rows = sorted(cur.fetchall())
+                conn.commit()
+            # NOW() is the transaction start, so every row of a claim shares it
+            claimed_at = rows[0][4] if rows else None
+            return Claim(claimed_at, [row[:4] for row in rows])
+        except Exception as e:
+            self.logger.error(f"Error claiming pending attendance: {str(e)}")
+            return None
+
+    def ack_claimed(self, claim, ids=None, status='PROCESSED'):
+        """Mark a claim's rows (or only ids) as done, or any other final status"""
+        return self._finish_claimed(claim, ids, status, 'ack_claimed')
+
+    def release_claimed(self, claim, ids=None):
+        """Hand a claim's rows (or only ids) back to the queue, e.g. after a processing error"""
+        return self._finish_claimed(claim, ids, 'PENDING', 'release_claimed')
+
+    def requeue_stale_claims(self, timeout=QUEUE_CLAIM_TIMEOUT):
+        """Return rows claimed more than timeout seconds ago to PENDING"""
+        try:
+            with self.connection() as conn, self._measure('requeue_stale_claims'), conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE zkt_attendance
+                    SET status = 'PENDING', claimed_at = NULL
+                    WHERE status = 'PROCESSING'
+                    AND claimed_at < NOW() - make_interval(secs => %s)
+                """, (timeout,))
+                requeued = cur.rowcount
+                conn.commit()
+            if requeued:
+                self.logger.warning(f"Requeued {requeued} attendance rows with stale claims")
+            return requeued
+        except Exception as e:
+            self.logger.error(f"Error requeueing stale claims: {str(e)}")
+            return None
+
+    def _finish_claimed(self, claim, ids, status, operation):
+        if ids is None:
+            ids = [row[0] for row in claim.rows]
+        if not ids:
+            return 0
+        try:
+            with self.connection() as conn, self._measure(operation), conn.cursor() as cur:
+                # Only rows still held by this claim: after a requeue another processor
+                # may have claimed them again, with a new claimed_at
+                cur.execute("""
+                    UPDATE zkt_attendance
+                    SET status = %s, claimed_at = NULL
+                    WHERE id = ANY(%s) AND status = 'PROCESSING' AND claimed_at = %s
+                """, (status, list(ids), claim.claimed_at))
+                updated = cur.rowcount
+                conn.commit()
+            return updated
+        except Exception as e:
+            self.logger.error(f"Error setting {len(ids)} claimed attendance rows to {status}: {str(e)}")
+            return None
+
+    def _ensure_users(self, cur, user_ids):
+        """Insert placeholder users for unknown ids and return the ids not cached yet"""
+        with self.users_lock:
+            user_ids = sorted(user_id for user_id in user_ids if user_id not in self.user_fingerprints)
+        if not user_ids:
+            return []
+
+        # Callers pass the returned ids to _remember_users once the transaction commits
+        execute_values(cur, """
+            INSERT INTO zkt_users (user_id, username, created_at, updated_at)
+            VALUES %s
+            ON CONFLICT (user_id) DO NOTHING
+        """, [(user_id, f"User {user_id}") for user_id in user_ids],
+            template="(%s, %s, NOW(), NOW())", page_size=BULK_INSERT_PAGE_SIZE)
+        return user_ids
+
+    def _remember_users(self, user_ids):
+        """Cache ids known to exist; setdefault keeps fingerprints of synced users"""
+        with self.users_lock:
+            for user_id in user_ids:
+                self.user_fingerprints.setdefault(user_id, None)
+
+    def _insert_attendance_rows(self, cur, records, device_serial):
+        """Insert records as multi-row VALUES pages and return how many were new"""
+        if not records:
+            return 0
+
+        rows = [
+            (record.user_id, record.timestamp, device_serial, 'PENDING')
+            for record in records
+        ]
+        inserted = execute_values(cur, """
+            INSERT INTO zkt_attendance
+            (user_id, timestamp, device_serial, status, created_at)
+            VALUES %s
+            ON CONFLICT (user_id, timestamp, device_serial) DO NOTHING
+            RETURNING id
+        """, rows, template="(%s, %s, %s, %s, NOW())", page_size=BULK_INSERT_PAGE_SIZE, fetch=True)
+        self._notify_inserted(cur, device_serial, [row[0] for row in inserted])
+        return len(inserted)
+
+    def _notify_inserted(self, cur, device_serial, ids):
+        """Queue one NOTIFY describing rows inserted by the caller's transaction"""
+        if not NOTIFY_ENABLED or not ids:
+            return
+        payload = json.dumps({
+            'device_serial': device_serial,
+            'first_id': min(ids),
+            'last_id': max(ids),
+            'count': len(ids),
+        }, separators=(',', ':'))
+        # Delivered only once the transaction commits; the id range may also
+        # span other devices' rows, so consumers filter by device_serial too
+        cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, payload))
+
     def sync_device_records(self, records, device_serial):
-        """Full sync of device records"""
-        try:
-            old_count = self.get_attendance_count_by_device(device_serial)
-            
-            with self.conn.cursor() as cur:
-                cur.execute("DELETE FROM zkt_attendance WHERE device_serial = %s", (device_serial,))
-                
-                # Batch insert all records
-                batch_size = 100
-                for i in range(0, len(records), batch_size):
-                    batch = records[i:i + batch_size]
-                    for record in batch:
-                        cur.execute("""
-                            INSERT INTO zkt_attendance 
-                            (user_id, timestamp, device_serial, status, created_at)
-                            VALUES (%s, %s, %s, %s, NOW())
-                        """, (
-                            record['user_id'],
-                            str(record['timestamp']),
-                            device_serial,
-                            'PENDING'
-                        ))
-                
-                self.conn.commit()
-                new_count = self.get_attendance_count_by_device(device_serial)
-                self.logger.info(f"Full sync completed for device {device_serial}. Records: {old_count} -> {new_count}")
+        """Full sync of device records, applying only the delta against the database"""
+        try:
+            with self.connection() as conn, self._measure('sync_device_records'), conn.cursor() as cur:
+                stream = self._copy_to_staging(cur, records)
+
+                # Remove rows that vanished from the device
+                cur.execute("""
+                    DELETE FROM zkt_attendance a
+                    WHERE a.device_serial = %s
+                    AND NOT EXISTS (
+                        SELECT 1 FROM zkt_attendance_staging s
+                        WHERE s.user_id = a.user_id
+                        AND s.timestamp = a.timestamp
+                    )
+                """, (device_serial,))
+                deleted = cur.rowcount
+
+                # Add rows the database is missing
+                cur.execute("""
+                    INSERT INTO zkt_attendance
+                    (user_id, timestamp, device_serial, status, created_at)
+                    SELECT s.user_id, s.timestamp, %s, 'PENDING', NOW()
+                    FROM zkt_attendance_staging s
+                    ON CONFLICT (user_id, timestamp, device_serial) DO NOTHING
+                    RETURNING id
+                """, (device_serial,))
+                ids = [row[0] for row in cur.fetchall()]
+                inserted = len(ids)
+                self._notify_inserted(cur, device_serial, ids)
+
+                watermark = self._set_watermark(cur, device_serial, stream.last_timestamp, stream.count, advance_only=False)
+
+                conn.commit()
+                self.watermarks[device_serial] = tuple(watermark)
+                DB_ROWS_WRITTEN.labels('sync_device_records').inc(inserted + deleted)
+                self.logger.info(f"Full sync completed for device {device_serial}. Inserted: {inserted}, deleted: {deleted}")
                 return True
         except Exception as e:
             self.logger.error(f"Error during full sync for device {device_serial}: {str(e)}")
-            self.conn.rollback()
             return False
+
+    def sync_device_buckets(self, records, device_serial, buckets, bucket_format, start, end):
+        """Make the given time buckets of a device match its records exactly"""
+        try:
+            buckets = list(buckets)
+            # start and end bound the DELETE so only the partitions holding the buckets are scanned
+            with self.connection() as conn, self._measure('sync_device_buckets'), conn.cursor() as cur:
+                stream = self._copy_to_staging(cur, records)
+
+                cur.execute("""
+                    DELETE FROM zkt_attendance a
+                    WHERE a.device_serial = %s
+                    AND a.timestamp >= %s AND a.timestamp < %s
+                    AND to_char(a.timestamp, %s) = ANY(%s)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM zkt_attendance_staging s
+                        WHERE s.user_id = a.user_id
+                        AND s.timestamp = a.timestamp
+                    )
+                """, (device_serial, start, end, bucket_format, buckets))
+                deleted = cur.rowcount
+
+                cur.execute("""
+                    INSERT INTO zkt_attendance
+                    (user_id, timestamp, device_serial, status, created_at)
+                    SELECT s.user_id, s.timestamp, %s, 'PENDING', NOW()
+                    FROM zkt_attendance_staging s
+                    WHERE to_char(s.timestamp, %s) = ANY(%s)
+                    ON CONFLICT (user_id, timestamp, device_serial) DO NOTHING
+                    RETURNING id
+                """, (device_serial, bucket_format, buckets))
+                ids = [row[0] for row in cur.fetchall()]
+                inserted = len(ids)
+                self._notify_inserted(cur, device_serial, ids)
+
+                watermark = None
+                if stream.last_timestamp is not None:
+                    watermark = self._set_watermark(cur, device_serial, stream.last_timestamp, None)
+                conn.commit()
+
+            if watermark:
+                self.watermarks[device_serial] = tuple(watermark)
+            DB_ROWS_WRITTEN.labels('sync_device_buckets').inc(inserted + deleted)
+            self.logger.info(f"Repaired {len(buckets)} buckets for device {device_serial}. Inserted: {inserted}, deleted: {deleted}")
+            return inserted, deleted
+        except Exception as e:
+            self.logger.error(f"Error repairing buckets for device {device_serial}: {str(e)}")
+            return None
+
+    def _copy_to_staging(self, cur, records):
+        """COPY records into the session's staging table, returning the drained stream"""
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS zkt_attendance_staging (
+                user_id VARCHAR,
+                timestamp TIMESTAMPTZ
+            ) ON COMMIT DELETE ROWS
+        """)
+
+        stream = _CSVRecordStream(records)
+        cur.copy_expert(
+            "COPY zkt_attendance_staging (user_id, timestamp) FROM STDIN WITH (FORMAT csv)",
+            stream
+        )
+        cur.execute("ANALYZE zkt_attendance_staging")
+        return stream
+
+class _CSVRecordStream:
+    """Read-only file object that renders records as CSV on demand for COPY"""
+
+    def __init__(self, records):
+        self.records = iter(records)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.count = 0
+        self.last_timestamp = None
+
+    def read(self, size=-1):
+        for record in self.records:
+            self.writer.writerow((record.user_id, record.timestamp.isoformat(sep=' ')))
+            self.count += 1
+            if self.last_timestamp is None or record.timestamp > self.last_timestamp:
+                self.last_timestamp = record.timestamp
+            if 0 <= size <= self.buffer.tell():
+                break
+
+        data = self.buffer.getvalue()
+        if 0 <= size < len(data):
+            data, rest = data[:size], data[size:]
+        else:
+            rest = ''
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(rest)
+        return data
@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+import logging
+from config import (
+    INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL,
+    SPOOL_ENABLED, SPOOL_REPLAY_BATCH, SPOOL_RETRY_INTERVAL
+)
+from spool import Spool
+from metrics import INGEST_QUEUE_DEPTH, INGEST_FLUSH_EVENTS, INGEST_DEGRADED
+
+class IngestWriter:
+    """Single writer thread that batches attendance events from all devices
+
+    With a spool, each batch is made durable on disk before it is written to
+    the database. If the write fails the writer degrades to spooling only and
+    replays the backlog in bulk once the database accepts writes again.
+    Events in leftovers, spools no other writer replays, are replayed first.
+    """
+
+    def __init__(self, db_handler, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, queue_size=INGEST_QUEUE_SIZE, spool=None,
+                 leftovers=()):
+        self.db_handler = db_handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.spool = spool if spool is not None else (Spool() if SPOOL_ENABLED else None)
+        self.leftovers = list(leftovers) if self.spool else []
+        # True while the spool holds events the database has not accepted yet
+        self.degraded = False
+        self.next_retry = 0
+        self.stopping = threading.Event()
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """Start the writer thread, replaying anything left in the spool first"""
+        if self.spool and any(spool.pending() for spool in self.leftovers + [self.spool]):
+            self.logger.info("Found spooled attendance events from a previous run")
+            self.degraded = True
+        INGEST_QUEUE_DEPTH.set_function(self.queue.qsize)
+        INGEST_DEGRADED.set_function(lambda: int(self.degraded))
+        self.thread = threading.Thread(target=self._run, name="ingest-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Flush whatever is queued and stop the writer thread"""
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def submit(self, record, device_serial):
+        """Queue one record, blocking while the queue is full"""
+        self.queue.put((device_serial, record))
+
+    def _run(self):
+        batch = []
+        deadline = None
+
+        while not (self.stopping.is_set() and self.queue.empty()):
+            timeout = self.flush_interval if not batch else max(0, deadline - time.monotonic())
+            try:
+                event = self.queue.get(timeout=timeout)
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(event)
+            except queue.Empty:
+                pass
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+
+            if self.degraded and time.monotonic() >= self.next_retry:
+                self._drain()
+
+        if batch:
+            self._flush(batch)
+        if self.spool:
+            self.spool.seal()
+
+    def _flush(self, batch):
+        INGEST_FLUSH_EVENTS.observe(len(batch))
+        spooled = False
+        if self.spool:
+            try:
+                self.spool.append(batch)
+                spooled = True
+            except OSError as e:
+                self.logger.error(f"Could not spool {len(batch)} attendance events: {str(e)}")
+
+        # Keep the spool in order: nothing new reaches the database before the backlog
+        if self.degraded and spooled:
+            return
+
+        if self.db_handler.save_attendance_events(batch):
+            if spooled and not self.degraded:
+                self.spool.discard()
+            for _, record in batch:
+                print(f"\nLive event: User {record.user_id} at {record.timestamp}")
+        elif spooled:
+            self.logger.warning(f"Database unavailable, spooling attendance events to {self.spool.directory}")
+            self.degraded = True
+            self.next_retry = time.monotonic() + SPOOL_RETRY_INTERVAL
+        else:
+            self.logger.error(f"Dropped {len(batch)} attendance events after database error")
+
+    def _drain(self):
+        """Replay spooled events segment by segment, deleting each once committed"""
+        self.spool.seal()
+        replayed = 0
+        # Leftover spools are from an earlier run, so older than anything in our own
+        for spool in self.leftovers + [self.spool]:
+            for path in spool.segments():
+                events = list(spool.read(path))
+                for start in range(0, len(events), SPOOL_REPLAY_BATCH):
+                    if not self.db_handler.save_attendance_events(events[start:start + SPOOL_REPLAY_BATCH]):
+                        self.logger.warning(f"Spool replay failed, retrying in {SPOOL_RETRY_INTERVAL}s")
+                        self.next_retry = time.monotonic() + SPOOL_RETRY_INTERVAL
+                        return
+                spool.remove(path)
+                replayed += len(events)
+
+        self.degraded = False
+        self.logger.info(f"Replayed {replayed} spooled attendance events")
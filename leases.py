@@ -0,0 +1,123 @@
+import logging
+import threading
+import psycopg2
+from db import connect_params
+from config import LEASE_NAMESPACE, LEASE_HEARTBEAT_INTERVAL
+
+class LeaseLost(Exception):
+    """This node no longer owns the device it was working on"""
+
+class DeviceLeases:
+    """Device ownership across pusher nodes via PostgreSQL advisory locks
+
+    Every device is guarded by a session-level advisory lock keyed on its
+    address, held on a dedicated connection. Only the node holding the lock
+    talks to the device; the others keep retrying and take over as soon as
+    the owner's session ends, whether it shut down, crashed or lost its
+    network (the server notices through TCP keepalives). If this node's own
+    lease connection fails, it gives up every device at once, since the
+    server has released its locks.
+    """
+
+    def __init__(self, namespace=LEASE_NAMESPACE, heartbeat_interval=LEASE_HEARTBEAT_INTERVAL):
+        self.namespace = namespace
+        self.heartbeat_interval = heartbeat_interval
+        self.conn = None
+        # Device keys this node currently holds
+        self.owned = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """Open the lease connection and start the heartbeat thread"""
+        with self.lock:
+            try:
+                self._connect()
+            except Exception as e:
+                # acquire() reconnects, so devices are claimed once the database is back
+                self.logger.error(f"Could not open lease connection: {str(e)}")
+        self.thread = threading.Thread(target=self._heartbeat, name="leases")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Release every lease by closing the session"""
+        self.stopping.set()
+        with self.lock:
+            self.owned.clear()
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def acquire(self, key):
+        """Claim a device without waiting; True when this node owns it"""
+        with self.lock:
+            if key in self.owned:
+                return True
+            try:
+                if self.conn is None or self.conn.closed:
+                    self._connect()
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (self.namespace, key))
+                    acquired = cur.fetchone()[0]
+            except Exception as e:
+                self._lose_all(e)
+                return False
+
+            if acquired:
+                self.owned.add(key)
+                self.logger.info(f"Acquired lease for device {key}")
+            return acquired
+
+    def release(self, key):
+        with self.lock:
+            if key not in self.owned:
+                return
+            self.owned.discard(key)
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (self.namespace, key))
+                self.logger.info(f"Released lease for device {key}")
+            except Exception as e:
+                self._lose_all(e)
+
+    def holds(self, key):
+        """True while this node owns the device; cheap enough to call per event"""
+        return key in self.owned
+
+    def _connect(self):
+        # Keepalives on both ends: this node notices a dead server and the
+        # server drops a dead node's session, and with it its locks, within ~30s
+        self.conn = psycopg2.connect(**connect_params(
+            keepalives=1, keepalives_idle=10, keepalives_interval=5, keepalives_count=3
+        ))
+        self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            cur.execute("SET tcp_keepalives_idle = 10")
+            cur.execute("SET tcp_keepalives_interval = 5")
+            cur.execute("SET tcp_keepalives_count = 3")
+
+    def _lose_all(self, error):
+        """The session is gone, and with it every lock it held"""
+        if self.owned:
+            self.logger.error(f"Lease connection failed, giving up {len(self.owned)} devices: {str(error)}")
+        self.owned.clear()
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def _heartbeat(self):
+        while not self.stopping.wait(self.heartbeat_interval):
+            with self.lock:
+                if self.conn is None:
+                    continue
+                try:
+                    with self.conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                except Exception as e:
+                    self._lose_all(e)
@@ -0,0 +1,258 @@
+import argparse
+import logging
+import time
+import psycopg2
+from config import DB_TIMEZONE, MIGRATION_BATCH_SIZE
+from db import connect_params
+
+class TimestampMigration:
+    """Online migration of zkt_attendance.timestamp from VARCHAR to TIMESTAMPTZ
+
+    The new column is backfilled in small id-range batches while a trigger
+    keeps fresh inserts in sync, the replacement indexes are built
+    concurrently, and only the final column swap takes a short exclusive lock.
+    Every step is idempotent, so an interrupted run can simply be restarted.
+    """
+
+    def __init__(self, batch_size=MIGRATION_BATCH_SIZE, pause=0):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.conn = None
+        self.logger = logging.getLogger(__name__)
+
+    def run(self):
+        """Run every migration step, returning True once the column is native"""
+        try:
+            self.conn = psycopg2.connect(**connect_params())
+            self.conn.autocommit = True
+
+            if self._column_type('timestamp') == 'timestamp with time zone':
+                self.logger.info("zkt_attendance.timestamp is already TIMESTAMPTZ, nothing to do")
+                return True
+
+            self.add_shadow_column()
+            self.backfill()
+            self.build_indexes()
+            self.swap()
+            self.logger.info("Timestamp migration completed")
+            return True
+        except Exception as e:
+            self.logger.error(f"Timestamp migration failed: {str(e)}")
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+
+    def add_shadow_column(self):
+        """Add the TIMESTAMPTZ column and a trigger that fills it for new writes"""
+        with self.conn.cursor() as cur:
+            cur.execute("ALTER TABLE zkt_attendance ADD COLUMN IF NOT EXISTS timestamp_native TIMESTAMPTZ")
+            # The zone is pinned on the function too: pushers not yet upgraded insert from unpinned sessions
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION zkt_attendance_sync_timestamp() RETURNS trigger AS $$
+                BEGIN
+                    NEW.timestamp_native := NEW.timestamp::timestamptz;
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql SET timezone = %s
+            """, (DB_TIMEZONE,))
+            cur.execute("DROP TRIGGER IF EXISTS zkt_attendance_sync_timestamp ON zkt_attendance")
+            cur.execute("""
+                CREATE TRIGGER zkt_attendance_sync_timestamp
+                BEFORE INSERT OR UPDATE OF timestamp ON zkt_attendance
+                FOR EACH ROW EXECUTE FUNCTION zkt_attendance_sync_timestamp()
+            """)
+        self.logger.info("Added timestamp_native column and sync trigger")
+
+    def backfill(self):
+        """Copy existing values into the new column, one committed id range at a time"""
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT MIN(id), MAX(id) FROM zkt_attendance")
+            min_id, max_id = cur.fetchone()
+            if min_id is None:
+                return
+
+            updated = 0
+            for start in range(min_id, max_id + 1, self.batch_size):
+                cur.execute("""
+                    UPDATE zkt_attendance
+                    SET timestamp_native = timestamp::timestamptz
+                    WHERE id >= %s AND id < %s
+                    AND timestamp_native IS NULL
+                    AND timestamp IS NOT NULL
+                """, (start, start + self.batch_size))
+                updated += cur.rowcount
+                self.logger.info(f"Backfilled ids {start}-{min(start + self.batch_size - 1, max_id)} ({updated} rows so far)")
+                if self.pause:
+                    time.sleep(self.pause)
+
+    def build_indexes(self):
+        """Build the replacement indexes without blocking writers"""
+        self._build_index("zkt_attendance_native_key", """
+            CREATE UNIQUE INDEX CONCURRENTLY zkt_attendance_native_key
+            ON zkt_attendance (user_id, timestamp_native, device_serial)
+        """)
+        self._build_index("idx_zkt_attendance_timestamp_native", """
+            CREATE INDEX CONCURRENTLY idx_zkt_attendance_timestamp_native
+            ON zkt_attendance (timestamp_native)
+        """)
+        self._build_index("idx_zkt_attendance_device_timestamp_native", """
+            CREATE INDEX CONCURRENTLY idx_zkt_attendance_device_timestamp_native
+            ON zkt_attendance (device_serial, timestamp_native)
+        """)
+
+    def swap(self):
+        """Replace the VARCHAR column with the native one in a single short transaction"""
+        self.conn.autocommit = False
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("LOCK TABLE zkt_attendance IN ACCESS EXCLUSIVE MODE")
+
+                # Rows written between the backfill and the lock
+                cur.execute("""
+                    UPDATE zkt_attendance SET timestamp_native = timestamp::timestamptz
+                    WHERE timestamp_native IS NULL AND timestamp IS NOT NULL
+                """)
+
+                cur.execute("DROP TRIGGER zkt_attendance_sync_timestamp ON zkt_attendance")
+                cur.execute("DROP FUNCTION zkt_attendance_sync_timestamp()")
+
+                cur.execute("""
+                    SELECT conname FROM pg_constraint
+                    WHERE conrelid = 'zkt_attendance'::regclass AND contype = 'u'
+                """)
+                for (constraint,) in cur.fetchall():
+                    cur.execute(f'ALTER TABLE zkt_attendance DROP CONSTRAINT "{constraint}"')
+                cur.execute("DROP INDEX IF EXISTS idx_zkt_attendance_timestamp")
+
+                cur.execute("ALTER TABLE zkt_attendance DROP COLUMN timestamp")
+                cur.execute("ALTER TABLE zkt_attendance RENAME COLUMN timestamp_native TO timestamp")
+
+                cur.execute("""
+                    ALTER TABLE zkt_attendance
+                    ADD CONSTRAINT zkt_attendance_user_id_timestamp_device_serial_key
+                    UNIQUE USING INDEX zkt_attendance_native_key
+                """)
+                cur.execute("ALTER INDEX idx_zkt_attendance_timestamp_native RENAME TO idx_zkt_attendance_timestamp")
+                cur.execute("ALTER INDEX idx_zkt_attendance_device_timestamp_native RENAME TO idx_zkt_attendance_device_timestamp")
+
+            self.conn.commit()
+            self.logger.info("Swapped zkt_attendance.timestamp to TIMESTAMPTZ")
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.autocommit = True
+
+    def _column_type(self, column):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'zkt_attendance' AND column_name = %s
+            """, (column,))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def _build_index(self, name, definition):
+        _build_index(self.conn, self.logger, name, definition)
+
+class QueueMigration:
+    """Online upgrade to the downstream work queue (claimed_at and its partial indexes)"""
+
+    # Index name suffix -> (columns, predicate), as in schema.sql
+    INDEXES = {
+        'pending': ('id', "status = 'PENDING'"),
+        'processing': ('claimed_at', "status = 'PROCESSING'"),
+    }
+
+    def __init__(self):
+        self.conn = None
+        self.logger = logging.getLogger(__name__)
+
+    def run(self):
+        """Add the column and build the indexes, returning True once they exist"""
+        try:
+            self.conn = psycopg2.connect(**connect_params())
+            self.conn.autocommit = True
+
+            with self.conn.cursor() as cur:
+                # Nullable without a default, so this only touches the catalog
+                cur.execute("ALTER TABLE zkt_attendance ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ")
+            for suffix, (columns, predicate) in self.INDEXES.items():
+                self.build_index('zkt_attendance', f"idx_zkt_attendance_{suffix}", suffix, columns, predicate)
+            self.logger.info("Work queue migration completed")
+            return True
+        except Exception as e:
+            self.logger.error(f"Work queue migration failed: {str(e)}")
+            return False
+        finally:
+            if self.conn:
+                self.conn.close()
+
+    def build_index(self, table, name, suffix, columns, predicate):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", (table,))
+            if cur.fetchone()[0] != 'p':
+                _build_index(self.conn, self.logger, name, f"""
+                    CREATE INDEX CONCURRENTLY {name} ON {table} ({columns}) WHERE {predicate}
+                """)
+                return
+
+            if _index_valid(self.conn, name):
+                return
+            # CONCURRENTLY is not supported on partitioned tables
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({columns}) WHERE {predicate}")
+            cur.execute("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = %s::regclass
+            """, (table,))
+            for (partition,) in cur.fetchall():
+                partition_index = f"{partition}_{suffix}_idx"
+                self.build_index(partition, partition_index, suffix, columns, predicate)
+                # The parent index turns valid once every partition's is attached
+                cur.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+def _index_valid(conn, name):
+    """True for a usable index, False for a missing one, None for one a failed build left invalid"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s
+        """, (name,))
+        row = cur.fetchone()
+        if row is None:
+            return False
+        return True if row[0] else None
+
+def _build_index(conn, logger, name, definition):
+    valid = _index_valid(conn, name)
+    if valid:
+        return
+
+    with conn.cursor() as cur:
+        # A failed concurrent build leaves an invalid index behind
+        if valid is None:
+            cur.execute(f"DROP INDEX CONCURRENTLY {name}")
+
+        logger.info(f"Building index {name}...")
+        cur.execute(definition)
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Upgrade zkt_attendance online: native TIMESTAMPTZ timestamps and the work queue indexes")
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE, help="rows per backfill transaction")
+    parser.add_argument('--pause', type=float, default=0, help="seconds to sleep between backfill batches")
+    args = parser.parse_args()
+
+    if not TimestampMigration(args.batch_size, args.pause).run():
+        raise SystemExit(1)
+    if not QueueMigration().run():
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
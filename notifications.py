@@ -0,0 +1,100 @@
+import argparse
+import json
+import logging
+import select
+import time
+from collections import namedtuple
+import psycopg2
+from config import NOTIFY_CHANNEL
+from db import connect_params
+
+# One committed insert of new punches for a device, as published by DatabaseHandler
+PunchBatch = namedtuple('PunchBatch', 'device_serial first_id last_id count')
+
+class AttendanceListener:
+    """Consumer side of the new-punch notifications"""
+
+    def __init__(self, channel=NOTIFY_CHANNEL):
+        self.channel = channel
+        self.conn = None
+        self.stopping = False
+        # True after listen() had to reopen the connection; notifications sent
+        # meanwhile are lost, so consumers should catch up from the table once
+        self.reconnected = False
+        self.logger = logging.getLogger(__name__)
+
+    def connect(self):
+        self.conn = psycopg2.connect(**connect_params())
+        self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+
+    def close(self):
+        """Stop listen() and drop the connection; safe to call from another thread"""
+        self.stopping = True
+        if self.conn is not None:
+            self.conn.close()
+
+    def listen(self, timeout=5):
+        """Yield PunchBatch tuples as they are published, until close() is called"""
+        while not self.stopping:
+            try:
+                if self.conn is None or self.conn.closed:
+                    self.connect()
+                conn = self.conn
+
+                if select.select([conn], [], [], timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    try:
+                        yield PunchBatch(**json.loads(notification.payload))
+                    except (ValueError, TypeError) as e:
+                        self.logger.warning(f"Ignoring malformed notification {notification.payload!r}: {str(e)}")
+            except (psycopg2.Error, OSError, ValueError) as e:
+                # close() from another thread lands here too
+                if self.stopping:
+                    break
+                self.logger.error(f"Notification connection lost, reconnecting: {str(e)}")
+                if self.conn is not None and not self.conn.closed:
+                    self.conn.close()
+                self.conn = None
+                self.reconnected = True
+                time.sleep(1)
+
+    def fetch(self, batch):
+        """The attendance rows a batch announced, oldest first"""
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, user_id, timestamp, device_serial, status
+                FROM zkt_attendance
+                WHERE id BETWEEN %s AND %s AND device_serial = %s
+                ORDER BY id
+            """, (batch.first_id, batch.last_id, batch.device_serial))
+            return cur.fetchall()
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Print new attendance punches as they are committed")
+    parser.add_argument('--channel', default=NOTIFY_CHANNEL)
+    parser.add_argument('--rows', action='store_true', help="also fetch and print every new row")
+    args = parser.parse_args()
+
+    listener = AttendanceListener(args.channel)
+    try:
+        for batch in listener.listen():
+            print(f"{batch.count} new punches from {batch.device_serial} (ids {batch.first_id}-{batch.last_id})")
+            if args.rows:
+                for row in listener.fetch(batch):
+                    print(f"  {row[0]}: user {row[1]} at {row[2]}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import logging
+import re
+import threading
+from datetime import date
+from config import (
+    PARTITION_PREMAKE_MONTHS, PARTITION_RETENTION_MONTHS,
+    PARTITION_DEVICE_BUCKETS, PARTITION_MAINTENANCE_INTERVAL
+)
+from db import DatabaseHandler
+
+PARTITION_NAME = re.compile(r'^zkt_attendance_y(\d{4})m(\d{2})$')
+
+def add_months(month, count):
+    """First day of the month count months after month"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f"zkt_attendance_y{month.year:04d}m{month.month:02d}"
+
+class PartitionManager:
+    """Creates and retires the monthly partitions of zkt_attendance
+
+    Only acts when the table was created from schema_partitioned.sql. Each
+    run makes sure partitions exist for the coming months and for any month
+    whose punches ended up in the default partition (e.g. history loaded at
+    startup, or a device with a wrong clock), moving those rows into place.
+    Months past the retention window are dropped as whole tables, which is
+    far cheaper than deleting their rows.
+    """
+
+    def __init__(self, db_handler, premake=PARTITION_PREMAKE_MONTHS,
+                 retention=PARTITION_RETENTION_MONTHS, device_buckets=PARTITION_DEVICE_BUCKETS):
+        self.db_handler = db_handler
+        self.premake = premake
+        self.retention = retention
+        self.device_buckets = device_buckets
+        self.stopping = threading.Event()
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def is_partitioned(self):
+        """True when zkt_attendance is a partitioned table"""
+        try:
+            with self.db_handler.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM pg_partitioned_table
+                        WHERE partrelid = to_regclass('zkt_attendance')
+                    )
+                """)
+                return cur.fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"Error checking attendance partitioning: {str(e)}")
+            return False
+
+    def start(self, interval=PARTITION_MAINTENANCE_INTERVAL):
+        """Run maintenance now and then every interval seconds from a daemon thread
+
+        Returns False without starting when the table is not partitioned.
+        """
+        if not self.is_partitioned():
+            self.logger.debug("zkt_attendance is not partitioned, skipping partition maintenance")
+            return False
+        self.thread = threading.Thread(target=self._run, args=(interval,), name="partitions")
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self, timeout=10):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self, today=None):
+        """One maintenance pass; returns (created, dropped) partition names or None on failure"""
+        try:
+            current = (today or date.today()).replace(day=1)
+            cutoff = add_months(current, -self.retention) if self.retention else None
+
+            existing = self._existing_months()
+            wanted = {add_months(current, offset) for offset in range(self.premake + 1)}
+            wanted.update(self._default_months())
+            if cutoff:
+                wanted = {month for month in wanted if month >= cutoff}
+
+            created = []
+            for month in sorted(wanted - existing):
+                self._create_month(month)
+                created.append(partition_name(month))
+
+            dropped = []
+            if cutoff:
+                for month in sorted(month for month in existing if month < cutoff):
+                    self._drop_month(month)
+                    dropped.append(partition_name(month))
+                self._purge_default(cutoff)
+
+            if created or dropped:
+                self.logger.info(f"Partition maintenance created {created or 'none'}, dropped {dropped or 'none'}")
+            return created, dropped
+        except Exception as e:
+            self.logger.error(f"Error maintaining attendance partitions: {str(e)}")
+            return None
+
+    def _run(self, interval):
+        while not self.stopping.is_set():
+            self.run()
+            self.stopping.wait(interval)
+
+    def _existing_months(self):
+        with self.db_handler.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'zkt_attendance'::regclass
+            """)
+            months = set()
+            for (name,) in cur.fetchall():
+                match = PARTITION_NAME.match(name)
+                if match:
+                    months.add(date(int(match.group(1)), int(match.group(2)), 1))
+            return months
+
+    def _default_months(self):
+        """Months that have rows waiting in the default partition"""
+        with self.db_handler.connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT date_trunc('month', timestamp) FROM zkt_attendance_default")
+            return {date(month.year, month.month, 1) for (month,) in cur.fetchall()}
+
+    def _create_month(self, month):
+        """Create one month partition, moving its rows out of the default partition"""
+        name = partition_name(month)
+        bounds = (month.isoformat(), add_months(month, 1).isoformat())
+
+        with self.db_handler.connection() as conn, conn.cursor() as cur:
+            # Attaching scans the default partition under an exclusive lock; don't queue behind writers forever
+            cur.execute("SET LOCAL lock_timeout = '10s'")
+
+            # A new partition may not overlap rows still in the default partition
+            cur.execute("""
+                CREATE TEMP TABLE zkt_partition_move ON COMMIT DROP AS
+                SELECT * FROM zkt_attendance_default
+                WHERE timestamp >= %s AND timestamp < %s
+            """, bounds)
+            moved = cur.rowcount
+            if moved:
+                cur.execute("""
+                    DELETE FROM zkt_attendance_default
+                    WHERE timestamp >= %s AND timestamp < %s
+                """, bounds)
+
+            subpartitioned = " PARTITION BY HASH (device_serial)" if self.device_buckets else ""
+            cur.execute(f"""
+                CREATE TABLE {name} PARTITION OF zkt_attendance
+                FOR VALUES FROM (%s) TO (%s){subpartitioned}
+            """, bounds)
+            for remainder in range(self.device_buckets):
+                cur.execute(f"""
+                    CREATE TABLE {name}_p{remainder} PARTITION OF {name}
+                    FOR VALUES WITH (MODULUS {self.device_buckets}, REMAINDER {remainder})
+                """)
+
+            if moved:
+                cur.execute("INSERT INTO zkt_attendance SELECT * FROM zkt_partition_move")
+            conn.commit()
+
+        if moved:
+            self.logger.info(f"Moved {moved} attendance records from the default partition into {name}")
+
+    def _drop_month(self, month):
+        with self.db_handler.connection() as conn, conn.cursor() as cur:
+            cur.execute("SET LOCAL lock_timeout = '10s'")
+            cur.execute(f"DROP TABLE {partition_name(month)}")
+            conn.commit()
+
+    def _purge_default(self, cutoff):
+        """Delete default-partition rows that are already past retention"""
+        with self.db_handler.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM zkt_attendance_default WHERE timestamp < %s", (cutoff.isoformat(),))
+            purged = cur.rowcount
+            conn.commit()
+        if purged:
+            self.logger.info(f"Deleted {purged} expired attendance records from the default partition")
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Create and retire monthly zkt_attendance partitions")
+    parser.add_argument('--premake', type=int, default=PARTITION_PREMAKE_MONTHS, help="months to create ahead")
+    parser.add_argument('--retention', type=int, default=PARTITION_RETENTION_MONTHS, help="months to keep, 0 keeps everything")
+    parser.add_argument('--device-buckets', type=int, default=PARTITION_DEVICE_BUCKETS, help="hash sub-partitions per month, 0 disables")
+    args = parser.parse_args()
+
+    db_handler = DatabaseHandler(pooled=False)
+    if not db_handler.connect():
+        raise SystemExit(1)
+    try:
+        manager = PartitionManager(db_handler, args.premake, args.retention, args.device_buckets)
+        if not manager.is_partitioned():
+            print("zkt_attendance is not partitioned; create it from schema_partitioned.sql first")
+            raise SystemExit(1)
+        if manager.run() is None:
+            raise SystemExit(1)
+    finally:
+        db_handler.disconnect()
+
+if __name__ == "__main__":
+    main()
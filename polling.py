@@ -0,0 +1,39 @@
+from config import POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_BACKOFF
+
+class AdaptiveInterval:
+    """Delay between polls of one device
+
+    Drops to the minimum as soon as a poll finds new records, so bursts at
+    shift change are picked up quickly, and grows by the backoff factor
+    after every idle poll up to the maximum, so quiet devices are left
+    mostly alone overnight.
+    """
+
+    def __init__(self, minimum=POLL_MIN_INTERVAL, maximum=POLL_MAX_INTERVAL, backoff=POLL_BACKOFF):
+        if minimum <= 0 or maximum < minimum or backoff < 1:
+            raise ValueError(f"Invalid poll schedule: min {minimum}, max {maximum}, backoff {backoff}")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.current = minimum
+
+    @classmethod
+    def for_device(cls, overrides=None):
+        """Build from the config defaults and a device's optional 'poll' dict"""
+        overrides = overrides or {}
+        return cls(
+            overrides.get('min', POLL_MIN_INTERVAL),
+            overrides.get('max', POLL_MAX_INTERVAL),
+            overrides.get('backoff', POLL_BACKOFF),
+        )
+
+    def next(self, found):
+        """Seconds to wait after a poll that did (or did not) find records"""
+        if found:
+            self.current = self.minimum
+        else:
+            self.current = min(self.current * self.backoff, self.maximum)
+        return self.current
+
+    def reset(self):
+        self.current = self.minimum
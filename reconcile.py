@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+from config import RECONCILE_BUCKET, RECONCILE_RECENT_BUCKETS, RECONCILE_FULL_INTERVAL
+
+# Bucket granularity -> (strftime format, matching PostgreSQL to_char format, bucket length)
+BUCKET_FORMATS = {
+    'day': ('%Y-%m-%d', 'YYYY-MM-DD', timedelta(days=1)),
+    'hour': ('%Y-%m-%d %H', 'YYYY-MM-DD HH24', timedelta(hours=1)),
+}
+
+def record_digest(user_id, timestamp):
+    """60-bit digest of one record, identical to the SQL in get_attendance_bucket_digests"""
+    text = f"{user_id}|{timestamp:%Y-%m-%d %H:%M:%S}"
+    return int(hashlib.md5(text.encode()).hexdigest()[:15], 16)
+
+class Reconciler:
+    """Checks a device against zkt_attendance bucket by bucket"""
+
+    def __init__(self, db_handler, bucket=RECONCILE_BUCKET, recent_buckets=RECONCILE_RECENT_BUCKETS,
+                 full_interval=RECONCILE_FULL_INTERVAL):
+        if bucket not in BUCKET_FORMATS:
+            raise ValueError(f"Unknown reconcile bucket '{bucket}', expected one of {sorted(BUCKET_FORMATS)}")
+        self.db_handler = db_handler
+        self.python_format, self.sql_format, self.length = BUCKET_FORMATS[bucket]
+        self.recent_buckets = recent_buckets
+        self.full_interval = full_interval
+        # Per device serial: log index and digest of each bucket's first record, the
+        # device's earliest timestamp and when the last full pass ran
+        self.positions = {}
+        self.logger = logging.getLogger(__name__)
+
+    def _digests(self, records, start=0, starts=None):
+        """Per-bucket (count, digest) of records read from log index start, and their earliest timestamp"""
+        digests = {}
+        seen = set()
+        first = None
+        for index, record in enumerate(records, start):
+            record_hash = record_digest(record.user_id, record.timestamp)
+            # The database stores a punch the device logged twice only once
+            if record_hash in seen:
+                continue
+            seen.add(record_hash)
+            if first is None or record.timestamp < first:
+                first = record.timestamp
+
+            bucket = record.timestamp.strftime(self.python_format)
+            if starts is not None and bucket not in starts:
+                starts[bucket] = (index, record_hash)
+            count, digest = digests.get(bucket, (0, 0))
+            digests[bucket] = (count + 1, digest + record_hash)
+        return digests, first
+
+    def device_digests(self, reader):
+        """Per-bucket (count, digest) of the device log and its earliest timestamp"""
+        return self._digests(reader.iter_attendance_logs())
+
+    def _mismatched(self, device, device_serial, since):
+        """Buckets from the oldest one in device on whose digests differ from the stored ones"""
+        stored = self.db_handler.get_attendance_bucket_digests(device_serial, self.sql_format, since=since)
+        if stored is None:
+            raise Exception("Could not read stored attendance digests")
+
+        oldest = min(device)
+        return sorted(
+            bucket for bucket in device.keys() | stored.keys()
+            if bucket >= oldest and device.get(bucket) != stored.get(bucket)
+        )
+
+    def diff(self, reader, device_serial):
+        """Buckets that differ between the device and the database, and the device's earliest timestamp"""
+        device, first = self.device_digests(reader)
+        if not device:
+            return [], None
+
+        # History before the earliest record is gone from the device (log cleared, firmware
+        # dropped its oldest records), so it is neither compared nor repaired
+        return self._mismatched(device, device_serial, first), first
+
+    def bucket_start(self, bucket):
+        return datetime.strptime(bucket, self.python_format)
+
+    def reconcile(self, reader, device_serial):
+        """Check and repair the whole device log; returns the repaired buckets or None on failure"""
+        try:
+            self.positions.pop(device_serial, None)
+            starts = {}
+            device, first = self._digests(reader.iter_attendance_logs(), 0, starts)
+            if not device:
+                return []
+            position = {'starts': starts, 'first': first, 'full_at': time.monotonic()}
+            self.positions[device_serial] = position
+
+            mismatched = self._mismatched(device, device_serial, first)
+            return self._repair(reader, device_serial, mismatched, position, None)
+        except Exception as e:
+            self.logger.error(f"Error reconciling device {device_serial}: {str(e)}")
+            return None
+
+    def check(self, reader, device_serial):
+        """Check and repair the most recent buckets, or the whole log when a full pass is due"""
+        position = self.positions.get(device_serial)
+        if not position or time.monotonic() - position['full_at'] >= self.full_interval:
+            return self.reconcile(reader, device_serial)
+
+        try:
+            starts = position['starts']
+            recent = sorted(starts)[-self.recent_buckets:]
+            records = self._read_from(reader, starts, recent)
+            if records is None:
+                # Only a full read gets this log layout; leave it to the full passes
+                return []
+            if records is False:
+                self.logger.info(f"Device {device_serial} log changed since it was indexed, checking all of it")
+                return self.reconcile(reader, device_serial)
+
+            # Every record of the recent buckets, and of any newer one, is in the tail
+            index = min(starts[bucket][0] for bucket in recent)
+            device, _ = self._digests(records, index, starts)
+            cutoff = recent[0]
+            device = {bucket: value for bucket, value in device.items() if bucket >= cutoff}
+            mismatched = self._mismatched(device, device_serial, self.bucket_start(cutoff))
+            return self._repair(reader, device_serial, mismatched, position, records)
+        except Exception as e:
+            self.logger.error(f"Error checking recent buckets of device {device_serial}: {str(e)}")
+            return None
+
+    def _read_from(self, reader, starts, buckets):
+        """The log from the first record of any of buckets on; None if the layout needs a
+        full read, False if that record is no longer where it was indexed"""
+        index, digest = min(starts[bucket] for bucket in buckets)
+        records = reader.fetch_attendance_tail(index)
+        if records is None:
+            return None
+        if not records or record_digest(records[0].user_id, records[0].timestamp) != digest:
+            return False
+        return records
+
+    def _repair(self, reader, device_serial, mismatched, position, records):
+        """Make the mismatched buckets match the device; records is a tail holding all of them, or None"""
+        if not mismatched:
+            self.logger.info(f"Device {device_serial} is consistent with the database")
+            return []
+
+        self.logger.info(f"Device {device_serial} differs in {len(mismatched)} buckets: {', '.join(mismatched[:10])}")
+        starts = position['starts']
+        on_device = [bucket for bucket in mismatched if bucket in starts]
+        if records is None and on_device:
+            # Download from the first record of the earliest mismatched bucket only
+            records = self._read_from(reader, starts, on_device) or None
+        if records is None:
+            records = reader.iter_attendance_logs() if on_device else []
+
+        wanted = set(mismatched)
+        records = (
+            record for record in records
+            if record.timestamp.strftime(self.python_format) in wanted
+        )
+        start = self.bucket_start(mismatched[0])
+        if mismatched[0] == position['first'].strftime(self.python_format):
+            # The device may only hold the tail of its oldest bucket: add missing rows, delete none
+            start += self.length
+        end = self.bucket_start(mismatched[-1]) + self.length
+        if self.db_handler.sync_device_buckets(records, device_serial, mismatched, self.sql_format, start, end) is None:
+            return None
+        return mismatched
@@ -0,0 +1,71 @@
+import logging
+import random
+import time
+from config import RECONNECT_INITIAL_DELAY, RECONNECT_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN
+
+class Backoff:
+    """Exponential delays with random jitter
+
+    Each delay is drawn between half and all of the exponential step, so
+    devices that dropped together (e.g. after a switch reboot) don't all
+    reconnect in the same instant.
+    """
+
+    def __init__(self, initial=RECONNECT_INITIAL_DELAY, maximum=RECONNECT_MAX_DELAY, factor=2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next(self):
+        """Delay before the next attempt"""
+        step = min(self.initial * self.factor ** self.attempts, self.maximum)
+        self.attempts += 1
+        return random.uniform(step / 2, step)
+
+    def reset(self):
+        self.attempts = 0
+
+class CircuitBreaker:
+    """Stops calling a device that keeps failing
+
+    After failure_threshold failures in a row the circuit opens and calls
+    are refused outright for cooldown seconds, so a dead terminal costs no
+    connect timeouts. Then a single trial call is let through (half open):
+    success closes the circuit, failure opens it for another cooldown.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.logger = logging.getLogger(__name__)
+
+    def allow(self):
+        """True when a call may be attempted now"""
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = 'half_open'
+            self.logger.info(f"Circuit for {self.name} half open, trying one call")
+        return self.state != 'open'
+
+    def remaining(self):
+        """Seconds until an open circuit lets a trial call through"""
+        if self.state != 'open':
+            return 0
+        return max(0, self.opened_at + self.cooldown - time.monotonic())
+
+    def record_success(self):
+        if self.state != 'closed':
+            self.logger.info(f"Circuit for {self.name} closed")
+        self.state = 'closed'
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self.logger.warning(f"Circuit for {self.name} open after {self.failures} failures, pausing for {self.cooldown}s")
@@ -0,0 +1,21 @@
+from collections import namedtuple
+
+class AttendanceRecord(namedtuple('AttendanceRecord', 'user_id timestamp punch status', defaults=(None, None))):
+    """One attendance punch as read from a device
+
+    A namedtuple with empty __slots__, so each record is a single small tuple
+    rather than a dict with its own hash table. punch and status are None for
+    sources that don't carry them (live events, the spool).
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_pyzk(cls, attendance):
+        """Convert a pyzk Attendance object"""
+        return cls(attendance.user_id, attendance.timestamp, attendance.punch, attendance.status)
+
+    @classmethod
+    def from_pyzk_list(cls, attendance):
+        """Convert a whole device download"""
+        return [cls(record.user_id, record.timestamp, record.punch, record.status) for record in attendance]
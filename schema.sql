@@ -2,6 +2,8 @@ CREATE TABLE IF NOT EXISTS zkt_users (
   id SERIAL PRIMARY KEY,
   user_id VARCHAR(50),
   username VARCHAR(100),
+  created_at TIMESTAMP DEFAULT NOW (),
+  updated_at TIMESTAMP DEFAULT NOW (),
   UNIQUE (user_id)
 );
 
@@ -9,7 +11,8 @@ CREATE TABLE IF NOT EXISTS zkt_attendance (
   id SERIAL PRIMARY KEY,
   created_at TIMESTAMP DEFAULT NOW (),
   status VARCHAR(50) DEFAULT 'PENDING',
-  timestamp VARCHAR(250),
+  claimed_at TIMESTAMPTZ,
+  timestamp TIMESTAMPTZ,
   device_serial VARCHAR(150) DEFAULT '000000',
   user_id VARCHAR,
   UNIQUE (user_id, timestamp, device_serial)
@@ -17,4 +20,18 @@ CREATE TABLE IF NOT EXISTS zkt_attendance (
 
 CREATE INDEX IF NOT EXISTS idx_zkt_attendance_user_id ON zkt_attendance (user_id);
 
-CREATE INDEX IF NOT EXISTS idx_zkt_attendance_timestamp ON zkt_attendance (timestamp);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_timestamp ON zkt_attendance (timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_device_timestamp ON zkt_attendance (device_serial, timestamp);
+
+-- Work queue for downstream processors (DatabaseHandler.claim_pending)
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_pending ON zkt_attendance (id) WHERE status = 'PENDING';
+
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_processing ON zkt_attendance (claimed_at) WHERE status = 'PROCESSING';
+
+CREATE TABLE IF NOT EXISTS zkt_device_watermarks (
+  device_serial VARCHAR(150) PRIMARY KEY,
+  last_timestamp TIMESTAMPTZ,
+  last_record_count INTEGER DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT NOW ()
+);
\ No newline at end of file
@@ -0,0 +1,48 @@
+-- Alternative to schema.sql for large installs: zkt_attendance is range
+-- partitioned by month on timestamp. Monthly partitions (optionally hash
+-- sub-partitioned by device_serial) are created and retired by partitions.py;
+-- punches outside every month partition land in zkt_attendance_default until
+-- the next maintenance run moves them.
+CREATE TABLE IF NOT EXISTS zkt_users (
+  id SERIAL PRIMARY KEY,
+  user_id VARCHAR(50),
+  username VARCHAR(100),
+  created_at TIMESTAMP DEFAULT NOW (),
+  updated_at TIMESTAMP DEFAULT NOW (),
+  UNIQUE (user_id)
+);
+
+-- Unique constraints on a partitioned table must include the partition keys,
+-- so the natural key is the only one and id is indexed separately
+CREATE TABLE IF NOT EXISTS zkt_attendance (
+  id BIGSERIAL,
+  created_at TIMESTAMP DEFAULT NOW (),
+  status VARCHAR(50) DEFAULT 'PENDING',
+  claimed_at TIMESTAMPTZ,
+  timestamp TIMESTAMPTZ NOT NULL,
+  device_serial VARCHAR(150) NOT NULL DEFAULT '000000',
+  user_id VARCHAR NOT NULL,
+  UNIQUE (user_id, timestamp, device_serial)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS zkt_attendance_default PARTITION OF zkt_attendance DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_id ON zkt_attendance (id);
+
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_user_id ON zkt_attendance (user_id);
+
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_timestamp ON zkt_attendance (timestamp);
+
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_device_timestamp ON zkt_attendance (device_serial, timestamp);
+
+-- Work queue for downstream processors (DatabaseHandler.claim_pending)
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_pending ON zkt_attendance (id) WHERE status = 'PENDING';
+
+CREATE INDEX IF NOT EXISTS idx_zkt_attendance_processing ON zkt_attendance (claimed_at) WHERE status = 'PROCESSING';
+
+CREATE TABLE IF NOT EXISTS zkt_device_watermarks (
+  device_serial VARCHAR(150) PRIMARY KEY,
+  last_timestamp TIMESTAMPTZ,
+  last_record_count INTEGER DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT NOW ()
+);
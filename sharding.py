@@ -0,0 +1,88 @@
+import logging
+import multiprocessing
+import time
+from config import SHARD_PROCESSES
+from reconnect import Backoff
+
+# A child that stayed up this long (seconds) before dying restarts without delay buildup
+SHARD_STABLE_AFTER = 60
+
+def shard_devices(devices, processes):
+    """Spread devices round robin over at most `processes` non-empty shards"""
+    count = max(1, min(processes, len(devices)))
+    return [devices[index::count] for index in range(count)]
+
+class ShardSupervisor:
+    """Runs groups of devices in separate worker processes
+
+    Each shard is a full pusher for its devices (monitors, ingest writer,
+    database pool and spool) in its own interpreter, so decoding device
+    downloads is spread over cores instead of contending for one GIL. The
+    parent only watches the children and restarts any that exit, with
+    jittered exponential backoff per shard.
+    """
+
+    def __init__(self, devices, target, processes=SHARD_PROCESSES):
+        self.shards = shard_devices(devices, processes)
+        # Called as target(devices, shard=index, shards=count) in the child; must be importable
+        self.target = target
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = [None] * len(self.shards)
+        self.started_at = [0] * len(self.shards)
+        self.restart_at = [0] * len(self.shards)
+        self.backoffs = [Backoff() for _ in self.shards]
+        self.logger = logging.getLogger(__name__)
+
+    def run(self):
+        """Start every shard and keep them running until Ctrl+C"""
+        print(f"Running {sum(len(shard) for shard in self.shards)} devices in {len(self.shards)} processes. Press Ctrl+C to exit.")
+        try:
+            for index in range(len(self.shards)):
+                self._start(index)
+            while True:
+                self._check()
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\nStopping shards...")
+        finally:
+            self.stop()
+
+    def stop(self, timeout=15):
+        """Wait for the children to finish (they get Ctrl+C too), then terminate stragglers"""
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0, deadline - time.monotonic()))
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                self.logger.warning(f"Shard {index} did not stop in time, terminating it")
+                process.terminate()
+                process.join()
+
+    def _check(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                continue
+
+            if process is not None:
+                # Children run until interrupted, so any exit is a crash
+                self.processes[index] = None
+                if now - self.started_at[index] >= SHARD_STABLE_AFTER:
+                    self.backoffs[index].reset()
+                delay = self.backoffs[index].next()
+                self.restart_at[index] = now + delay
+                self.logger.error(f"Shard {index} exited with code {process.exitcode}, restarting in {delay:.1f}s")
+
+            if now >= self.restart_at[index]:
+                self._start(index)
+
+    def _start(self, index):
+        devices = self.shards[index]
+        process = self.context.Process(
+            target=self.target, args=(devices,), kwargs={'shard': index, 'shards': len(self.shards)}, name=f"shard-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        self.logger.info(f"Started shard {index} (pid {process.pid}) with {len(devices)} devices")
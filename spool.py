@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import zlib
+from datetime import datetime
+from config import SPOOL_DIR, SPOOL_SEGMENT_SIZE
+from records import AttendanceRecord
+
+class Spool:
+    """Append-only on-disk log of attendance events awaiting the database
+
+    Events are appended as one checksummed line per batch and fsynced before
+    the database is touched, so a crash or an outage never loses a punch.
+    Lines are grouped into numbered segment files; a segment is deleted only
+    once every event in it has been committed. Replaying is safe to repeat
+    because attendance inserts skip rows that are already stored.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_size=SPOOL_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.active = None
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, events):
+        """Durably append a batch of (device_serial, record) events"""
+        payload = json.dumps([
+            [device_serial, record.user_id, record.timestamp.isoformat()]
+            for device_serial, record in events
+        ], separators=(',', ':'))
+        line = f"{zlib.crc32(payload.encode()):08x} {payload}\n".encode()
+
+        if self.active is None or self.active.tell() >= self.segment_size:
+            self._open_segment()
+        self.active.write(line)
+        self.active.flush()
+        os.fsync(self.active.fileno())
+
+    def discard(self):
+        """Forget everything spooled so far; the caller has committed it all"""
+        if self.active is not None and len(self.segments()) == 1:
+            # Common case: reuse the open segment instead of creating a new file
+            self.active.seek(0)
+            self.active.truncate()
+            return
+
+        self.seal()
+        for path in self.segments():
+            os.remove(path)
+
+    def seal(self):
+        """Close the segment being written so new appends start a fresh one"""
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+    def pending(self):
+        """True when segments hold events that may not be in the database yet"""
+        return any(os.path.getsize(path) > 0 for path in self.segments())
+
+    def segments(self):
+        """Segment paths, oldest first"""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith('.seg'))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def read(self, path):
+        """Yield the events in a segment, skipping lines that fail their checksum"""
+        with open(path, 'rb') as segment:
+            for number, line in enumerate(segment, 1):
+                try:
+                    checksum, payload = line.rstrip(b'\n').split(b' ', 1)
+                    if int(checksum, 16) != zlib.crc32(payload):
+                        raise ValueError("checksum mismatch")
+                    rows = json.loads(payload)
+                except ValueError as e:
+                    # A torn write at the tail after a crash lands here too
+                    self.logger.warning(f"Skipping corrupt spool line {number} in {path}: {str(e)}")
+                    continue
+
+                for device_serial, user_id, timestamp in rows:
+                    yield device_serial, AttendanceRecord(user_id, datetime.fromisoformat(timestamp))
+
+    def remove(self, path):
+        os.remove(path)
+
+    def _open_segment(self):
+        self.seal()
+        segments = self.segments()
+        number = int(os.path.basename(segments[-1])[:-4]) + 1 if segments else 1
+        path = os.path.join(self.directory, f"{number:012d}.seg")
+        self.active = open(path, 'ab')
+
+        # Make the new directory entry itself durable
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def stale_spools(in_use, directory=SPOOL_DIR):
+    """Spools under directory that none of the in_use directories covers"""
+    if not os.path.isdir(directory):
+        return []
+    candidates = [directory] + [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.startswith('shard-') and os.path.isdir(os.path.join(directory, name))
+    ]
+    in_use = {os.path.abspath(path) for path in in_use}
+    return [Spool(path) for path in candidates if os.path.abspath(path) not in in_use]
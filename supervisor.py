@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    SUPERVISOR_MAX_WORKERS, SUPERVISOR_STATUS_INTERVAL, RECONCILE_INTERVAL
+)
+from reconcile import Reconciler
+from polling import AdaptiveInterval
+from leases import LeaseLost
+from metrics import DEVICE_STATE
+
+# Every value of a device's 'state'
+STATES = ('pending', 'connecting', 'catching_up', 'running', 'standby', 'backoff', 'circuit_open', 'stopped')
+
+class DeviceSupervisor:
+    """Owns every device session on one asyncio loop with a fixed thread budget
+
+    Blocking pyzk calls run on a bounded executor, so the number of threads
+    does not grow with the fleet. A device worker that fails is restarted
+    after the reader's reconnect backoff; devices whose circuit breaker is
+    open are not contacted at all, so dead terminals don't tie up threads in
+    connect timeouts. Each device's state is kept in `states`.
+    """
+
+    def __init__(self, readers, writer, max_workers=SUPERVISOR_MAX_WORKERS,
+                 poll_interval=None):
+        self.readers = readers
+        self.writer = writer
+        self.max_workers = max_workers
+        # Fixed delay for every device; None uses each reader's adaptive schedule
+        self.poll_interval = poll_interval
+        self.reconciler = Reconciler(writer.db_handler)
+        self.executor = None
+        self.loop = None
+        self.stopping = None
+        self.states = {
+            self._key(reader): {
+                'ip': reader.ip,
+                'port': reader.port,
+                'serial': None,
+                'state': 'pending',
+                'restarts': 0,
+                'records': 0,
+                'last_poll': None,
+                'last_error': None,
+                'last_reconcile': None,
+                'interval': None,
+            }
+            for reader in readers
+        }
+        for reader in readers:
+            state = self.states[self._key(reader)]
+            for name in STATES:
+                DEVICE_STATE.labels(reader.address, name).set_function(
+                    lambda state=state, name=name: int(state['state'] == name)
+                )
+        self.logger = logging.getLogger(__name__)
+
+    def run(self):
+        """Supervise all devices until stop() is called"""
+        asyncio.run(self._main())
+
+    def stop(self):
+        """Ask the supervisor loop to shut down; safe to call from any thread"""
+        if self.loop and self.stopping:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def get_states(self):
+        """Snapshot of per-device state keyed by ip:port"""
+        return {key: dict(state) for key, state in self.states.items()}
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="device")
+
+        tasks = [asyncio.create_task(self._supervise(reader)) for reader in self.readers]
+        tasks.append(asyncio.create_task(self._report_status()))
+        try:
+            await self.stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for reader in self.readers:
+                await self._call(reader.drop_connection, False)
+            self.executor.shutdown(wait=False)
+
+    async def _call(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    async def _sleep(self, seconds):
+        """Sleep that returns early (True) when the supervisor is stopping"""
+        try:
+            await asyncio.wait_for(self.stopping.wait(), timeout=seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _supervise(self, reader):
+        state = self.states[self._key(reader)]
+
+        while not self.stopping.is_set():
+            failed = True
+            try:
+                await self._run_device(reader, state)
+                failed = False
+            except asyncio.CancelledError:
+                raise
+            except LeaseLost as e:
+                failed = False
+                self.logger.warning(f"{str(e)}, standing by")
+            except Exception as e:
+                state['last_error'] = str(e)
+                self.logger.error(f"Device worker for {self._key(reader)} failed: {str(e)}")
+
+            # A failed connect was already counted by ensure_connected
+            if reader.conn:
+                await self._call(reader.drop_connection, failed)
+            if self.stopping.is_set():
+                break
+
+            delay = reader.reconnect_delay()
+            if not reader.holds_lease():
+                state['state'] = 'standby'
+            else:
+                state['state'] = 'circuit_open' if reader.breaker.state == 'open' else 'backoff'
+                state['restarts'] += 1
+                self.logger.info(f"Restarting device worker for {self._key(reader)} in {delay:.1f}s")
+            if await self._sleep(delay):
+                break
+
+        state['state'] = 'stopped'
+
+    async def _run_device(self, reader, state):
+        state['state'] = 'connecting'
+        if not await self._call(reader.ensure_connected):
+            if not reader.holds_lease():
+                # Another node owns the device; _supervise retries after LEASE_RETRY_INTERVAL
+                return
+            raise Exception("Could not connect to device")
+
+        device_info = await self._call(reader.get_device_info)
+        state['serial'] = device_info if device_info else reader.ip
+        if reader.last_record_count is None:
+            # Taken over from another node, or the startup sync failed
+            state['state'] = 'catching_up'
+            await self._call(reader.catch_up, self.writer.db_handler, state['serial'])
+        state['state'] = 'running'
+        last_reconcile = time.monotonic()
+        if self.poll_interval is None:
+            schedule = reader.poll_schedule
+            schedule.reset()
+        else:
+            schedule = AdaptiveInterval(self.poll_interval, self.poll_interval)
+
+        while not self.stopping.is_set():
+            reader.check_lease()
+            await self._call(reader.sync_users, self.writer.db_handler)
+            records = await self._call(reader.fetch_new_attendance_logs)
+            if records:
+                await self._call(self._submit, records, state['serial'])
+                state['records'] += len(records)
+            state['last_poll'] = time.time()
+            state['last_error'] = None
+
+            if time.monotonic() - last_reconcile >= RECONCILE_INTERVAL:
+                await self._call(self.reconciler.check, reader, state['serial'])
+                state['last_reconcile'] = time.time()
+                last_reconcile = time.monotonic()
+
+            state['interval'] = schedule.next(bool(records))
+            if await self._sleep(state['interval']):
+                break
+
+    def _key(self, reader):
+        return f"{reader.ip}:{reader.port}"
+
+    def _submit(self, records, device_serial):
+        for record in records:
+            self.writer.submit(record, device_serial)
+
+    async def _report_status(self):
+        while not await self._sleep(SUPERVISOR_STATUS_INTERVAL):
+            counts = {}
+            for state in self.states.values():
+                counts[state['state']] = counts.get(state['state'], 0) + 1
+            summary = ", ".join(f"{name}: {count}" for name, count in sorted(counts.items()))
+            self.logger.info(f"Supervising {len(self.states)} devices ({summary})")
@@ -0,0 +1,43 @@
+import csv
+import io
+from datetime import datetime
+import pytest
+from db import _CSVRecordStream
+from records import AttendanceRecord
+
+RECORDS = [AttendanceRecord(str(index), datetime(2026, 1, 1 + index % 3, 8, index % 60)) for index in range(200)]
+
+def drain(stream, size):
+    parts = []
+    while True:
+        data = stream.read(size)
+        if not data:
+            return ''.join(parts)
+        parts.append(data)
+
+@pytest.mark.parametrize('size', [1, 7, 64, 8192, -1])
+def test_read_sizes_produce_the_same_csv(size):
+    stream = _CSVRecordStream(RECORDS)
+    rows = list(csv.reader(io.StringIO(drain(stream, size))))
+    assert rows == [[record.user_id, record.timestamp.isoformat(sep=' ')] for record in RECORDS]
+
+@pytest.mark.parametrize('size', [5, 8192])
+def test_reads_respect_the_size(size):
+    stream = _CSVRecordStream(RECORDS)
+    while True:
+        data = stream.read(size)
+        if not data:
+            break
+        assert len(data) <= size
+
+def test_tracks_count_and_newest_timestamp():
+    stream = _CSVRecordStream(iter(RECORDS))
+    drain(stream, 100)
+    assert stream.count == len(RECORDS)
+    assert stream.last_timestamp == max(record.timestamp for record in RECORDS)
+
+def test_empty():
+    stream = _CSVRecordStream([])
+    assert stream.read(100) == ''
+    assert stream.count == 0
+    assert stream.last_timestamp is None
@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+import psycopg2
+import pytest
+from config import DB_CONFIG, DB_TIMEZONE
+
+def require_postgres():
+    try:
+        psycopg2.connect(**DB_CONFIG).close()
+    except psycopg2.Error:
+        pytest.skip("PostgreSQL is not reachable")
+
+def test_sessions_use_the_configured_time_zone(monkeypatch):
+    from db import DatabaseHandler
+    require_postgres()
+    monkeypatch.setenv('PGTZ', 'Asia/Dhaka' if DB_TIMEZONE == 'UTC' else 'UTC')
+
+    handler = DatabaseHandler()
+    handler.connect()
+    try:
+        with handler.connection() as conn, conn.cursor() as cur:
+            cur.execute("SHOW timezone")
+            assert cur.fetchone()[0] == DB_TIMEZONE
+    finally:
+        handler.disconnect()
+
+@pytest.fixture
+def db_handler():
+    from db import DatabaseHandler
+    require_postgres()
+    handler = DatabaseHandler()
+    handler.connect()
+    handler.ensure_tables()
+    yield handler
+    with handler.connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM zkt_users WHERE user_id LIKE 'test-sync-%'")
+        conn.commit()
+    handler.disconnect()
+
+def user(number, name, privilege=0):
+    return {'user_id': f"test-sync-{number}", 'name': name, 'privilege': privilege, 'card': 0}
+
+def stored_users(handler):
+    with handler.connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT user_id, username, updated_at FROM zkt_users
+            WHERE user_id LIKE 'test-sync-%' ORDER BY user_id
+        """)
+        return cur.fetchall()
+
+def test_sync_users_counts_inserts_and_renames(db_handler):
+    users = [user(1, 'Ann'), user(2, 'Bob')]
+    assert db_handler.sync_users(users) == (2, 0)
+    assert db_handler.sync_users(users) == (0, 0)
+    assert db_handler.sync_users([user(1, 'Ann'), user(2, 'Rob')]) == (0, 1)
+    assert [row[:2] for row in stored_users(db_handler)] == [('test-sync-1', 'Ann'), ('test-sync-2', 'Rob')]
+
+def test_sync_users_leaves_unchanged_rows_alone(db_handler):
+    users = [user(1, 'Ann')]
+    db_handler.sync_users(users)
+    before = stored_users(db_handler)
+
+    # Forget the cache so the row reaches the database again
+    db_handler.users_reconciled_at = None
+    assert db_handler.sync_users(users) == (0, 0)
+    assert stored_users(db_handler) == before
+
+def test_sync_users_keeps_the_last_entry_per_id(db_handler):
+    assert db_handler.sync_users([user(1, 'Ann'), user(1, 'Anne')]) == (1, 0)
+    assert [row[1] for row in stored_users(db_handler)] == ['Anne']
+
+def rename_stored_user(handler, user_id, name):
+    with handler.connection() as conn, conn.cursor() as cur:
+        cur.execute("UPDATE zkt_users SET username = %s WHERE user_id = %s", (name, user_id))
+        conn.commit()
+
+def test_cached_users_skip_the_database_until_the_cache_is_reconciled(db_handler):
+    users = [user(1, 'Ann')]
+    db_handler.sync_users(users)
+    rename_stored_user(db_handler, 'test-sync-1', 'Drifted')
+
+    assert db_handler.sync_users(users) == (0, 0)
+    assert stored_users(db_handler)[0][1] == 'Drifted'
+
+    # A changed privilege sends the user again, which also restores the name
+    assert db_handler.sync_users([user(1, 'Ann', privilege=14)]) == (0, 1)
+    assert stored_users(db_handler)[0][1] == 'Ann'
+
+    rename_stored_user(db_handler, 'test-sync-1', 'Drifted')
+    db_handler.users_reconciled_at = None
+    assert db_handler.sync_users([user(1, 'Ann', privilege=14)]) == (0, 1)
+    assert stored_users(db_handler)[0][1] == 'Ann'
+
+def test_reconcile_is_claimed_before_the_write(db_handler, monkeypatch):
+    db_handler.sync_users([user(1, 'Ann')])
+    db_handler.users_reconciled_at = None
+    connection = db_handler.connection
+    seen = []
+
+    @contextmanager
+    def watching_connection():
+        seen.append((db_handler.users_reconciled_at, dict(db_handler.user_fingerprints)))
+        with connection() as conn:
+            yield conn
+
+    monkeypatch.setattr(db_handler, 'connection', watching_connection)
+    db_handler.sync_users([user(2, 'Bob')])
+    claimed_at, fingerprints = seen[0]
+    assert claimed_at is not None
+    assert fingerprints == {}
+
+def test_failed_reconcile_is_retried_on_the_next_sync(db_handler, monkeypatch):
+    @contextmanager
+    def broken_connection():
+        raise psycopg2.OperationalError("connection lost")
+        yield
+
+    monkeypatch.setattr(db_handler, 'connection', broken_connection)
+    assert db_handler.sync_users([user(1, 'Ann')]) is None
+    assert db_handler.users_reconciled_at is None
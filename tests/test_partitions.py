@@ -0,0 +1,14 @@
+from datetime import date
+from partitions import add_months, partition_name
+
+def test_add_months_crosses_years():
+    assert add_months(date(2026, 11, 1), 2) == date(2027, 1, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+    assert add_months(date(2026, 1, 1), -13) == date(2024, 12, 1)
+
+def test_add_months_starts_at_the_first_of_the_month():
+    assert add_months(date(2026, 3, 31), 1) == date(2026, 4, 1)
+    assert add_months(date(2026, 3, 15), 0) == date(2026, 3, 1)
+
+def test_partition_name():
+    assert partition_name(date(2026, 3, 1)) == 'zkt_attendance_y2026m03'
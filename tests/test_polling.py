@@ -0,0 +1,29 @@
+import pytest
+from polling import AdaptiveInterval
+
+def test_backs_off_while_idle_up_to_maximum():
+    schedule = AdaptiveInterval(1, 10, 2)
+    assert [schedule.next(False) for _ in range(5)] == [2, 4, 8, 10, 10]
+
+def test_drops_to_minimum_when_records_are_found():
+    schedule = AdaptiveInterval(1, 10, 2)
+    schedule.next(False)
+    schedule.next(False)
+    assert schedule.next(True) == 1
+    assert schedule.next(False) == 2
+
+def test_reset():
+    schedule = AdaptiveInterval(0.5, 30, 2)
+    schedule.next(False)
+    schedule.reset()
+    assert schedule.current == 0.5
+
+def test_device_overrides_fall_back_to_defaults():
+    schedule = AdaptiveInterval.for_device({'max': 300})
+    assert schedule.maximum == 300
+    assert schedule.minimum == AdaptiveInterval.for_device().minimum
+
+@pytest.mark.parametrize('minimum, maximum, backoff', [(0, 10, 2), (5, 1, 2), (1, 10, 0.5)])
+def test_rejects_invalid_schedules(minimum, maximum, backoff):
+    with pytest.raises(ValueError):
+        AdaptiveInterval(minimum, maximum, backoff)
@@ -0,0 +1,66 @@
+from datetime import datetime
+import psycopg2
+import pytest
+from config import DB_CONFIG
+from records import AttendanceRecord
+
+DEVICE = 'TEST-QUEUE'
+
+RECORDS = [
+    AttendanceRecord('7', datetime(2026, 1, 1, 8, 0)),
+    AttendanceRecord('7', datetime(2026, 1, 1, 17, 0)),
+]
+
+@pytest.fixture
+def db_handler():
+    from db import DatabaseHandler
+    try:
+        psycopg2.connect(**DB_CONFIG).close()
+    except psycopg2.Error:
+        pytest.skip("PostgreSQL is not reachable")
+    handler = DatabaseHandler()
+    handler.connect()
+    handler.ensure_tables()
+    handler.bulk_insert_attendance(RECORDS, DEVICE)
+    yield handler
+    with handler.connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM zkt_attendance WHERE device_serial = %s", (DEVICE,))
+        cur.execute("DELETE FROM zkt_device_watermarks WHERE device_serial = %s", (DEVICE,))
+        conn.commit()
+    handler.disconnect()
+
+def statuses(db_handler):
+    with db_handler.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT status FROM zkt_attendance WHERE device_serial = %s ORDER BY id", (DEVICE,))
+        return [status for (status,) in cur.fetchall()]
+
+def expire_claims(db_handler):
+    with db_handler.connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE zkt_attendance SET claimed_at = claimed_at - INTERVAL '1 day'
+            WHERE device_serial = %s AND status = 'PROCESSING'
+        """, (DEVICE,))
+        conn.commit()
+    assert db_handler.requeue_stale_claims(timeout=3600) >= 2
+
+def test_claim_and_ack(db_handler):
+    claim = db_handler.claim_pending(device_serial=DEVICE)
+    assert [row[1] for row in claim.rows] == ['7', '7']
+    assert all(row[3] == DEVICE for row in claim.rows)
+    assert db_handler.claim_pending(device_serial=DEVICE).rows == []
+    assert db_handler.ack_claimed(claim, [claim.rows[0][0]]) == 1
+    assert db_handler.release_claimed(claim) == 1
+    assert statuses(db_handler) == ['PROCESSED', 'PENDING']
+
+def test_late_release_leaves_a_new_claim_alone(db_handler):
+    stale = db_handler.claim_pending(device_serial=DEVICE)
+    expire_claims(db_handler)
+    current = db_handler.claim_pending(device_serial=DEVICE)
+    assert [row[0] for row in current.rows] == [row[0] for row in stale.rows]
+
+    assert db_handler.release_claimed(stale) == 0
+    assert db_handler.ack_claimed(stale) == 0
+    assert statuses(db_handler) == ['PROCESSING', 'PROCESSING']
+
+    assert db_handler.ack_claimed(current) == 2
+    assert statuses(db_handler) == ['PROCESSED', 'PROCESSED']
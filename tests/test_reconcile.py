@@ -0,0 +1,131 @@
+import hashlib
+from datetime import datetime
+import psycopg2
+import pytest
+from config import DB_CONFIG
+from reconcile import Reconciler, record_digest
+from records import AttendanceRecord
+
+class FakeReader:
+    def __init__(self, records):
+        self.records = records
+        self.full_reads = 0
+        self.tail_reads = []
+
+    def iter_attendance_logs(self):
+        self.full_reads += 1
+        return iter(self.records)
+
+    def fetch_attendance_tail(self, start):
+        self.tail_reads.append(start)
+        return self.records[start:]
+
+RECORDS = [
+    AttendanceRecord('7', datetime(2026, 1, 1, 8, 0, 5)),
+    AttendanceRecord('7', datetime(2026, 1, 1, 17, 30)),
+    AttendanceRecord('12', datetime(2026, 1, 2, 8, 1)),
+]
+
+def test_record_digest_is_a_60_bit_md5_prefix():
+    expected = int(hashlib.md5(b'7|2026-01-01 08:00:05').hexdigest()[:15], 16)
+    assert record_digest('7', datetime(2026, 1, 1, 8, 0, 5)) == expected
+    assert expected < 2 ** 60
+
+def test_record_digest_ignores_microseconds():
+    assert record_digest('7', datetime(2026, 1, 1, 8, 0, 5, 999)) == record_digest('7', datetime(2026, 1, 1, 8, 0, 5))
+
+def test_device_digests_by_day():
+    digests, first = Reconciler(None, 'day').device_digests(FakeReader(RECORDS))
+    assert first == RECORDS[0].timestamp
+    assert digests == {
+        '2026-01-01': (2, record_digest('7', RECORDS[0].timestamp) + record_digest('7', RECORDS[1].timestamp)),
+        '2026-01-02': (1, record_digest('12', RECORDS[2].timestamp)),
+    }
+
+def test_device_digests_by_hour():
+    digests, _ = Reconciler(None, 'hour').device_digests(FakeReader(RECORDS))
+    assert sorted(digests) == ['2026-01-01 08', '2026-01-01 17', '2026-01-02 08']
+
+def test_device_digests_count_a_repeated_punch_once():
+    reconciler = Reconciler(None, 'day')
+    assert reconciler.device_digests(FakeReader(RECORDS + RECORDS[:1])) == reconciler.device_digests(FakeReader(RECORDS))
+
+def test_unknown_bucket():
+    with pytest.raises(ValueError):
+        Reconciler(None, 'week')
+
+@pytest.fixture
+def db_handler():
+    from db import DatabaseHandler
+    try:
+        psycopg2.connect(**DB_CONFIG).close()
+    except psycopg2.Error:
+        pytest.skip("PostgreSQL is not reachable")
+    handler = DatabaseHandler()
+    handler.connect()
+    handler.ensure_tables()
+    yield handler
+    with handler.connection() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM zkt_attendance WHERE device_serial = 'TEST-RECONCILE'")
+        cur.execute("DELETE FROM zkt_device_watermarks WHERE device_serial = 'TEST-RECONCILE'")
+        conn.commit()
+    handler.disconnect()
+
+def test_sql_digests_match_the_device_side(db_handler):
+    reconciler = Reconciler(db_handler, 'day')
+    assert db_handler.bulk_insert_attendance(RECORDS, 'TEST-RECONCILE') == (3, 0)
+    stored = db_handler.get_attendance_bucket_digests('TEST-RECONCILE', reconciler.sql_format)
+    assert stored == reconciler.device_digests(FakeReader(RECORDS))[0]
+
+def test_history_before_the_oldest_device_record_is_kept(db_handler):
+    reconciler = Reconciler(db_handler, 'day')
+    db_handler.bulk_insert_attendance(RECORDS, 'TEST-RECONCILE')
+
+    # The firmware dropped the first punch of the oldest day
+    device = FakeReader(RECORDS[1:])
+    assert reconciler.diff(device, 'TEST-RECONCILE') == ([], RECORDS[1].timestamp)
+
+    # A punch missing from the oldest day is added back without deleting the dropped one
+    device = FakeReader(RECORDS[1:] + [AttendanceRecord('9', datetime(2026, 1, 1, 18, 0))])
+    assert reconciler.reconcile(device, 'TEST-RECONCILE') == ['2026-01-01']
+    stored = db_handler.get_attendance_bucket_digests('TEST-RECONCILE', reconciler.sql_format)
+    assert stored['2026-01-01'][0] == 3
+
+def test_recent_check_reads_only_the_recent_buckets(db_handler):
+    reconciler = Reconciler(db_handler, 'day', recent_buckets=1)
+    device = FakeReader(list(RECORDS))
+    assert reconciler.check(device, 'TEST-RECONCILE') == ['2026-01-01', '2026-01-02']
+    assert device.full_reads == 1
+
+    # A punch on the newest day is repaired from a tail read starting at that day
+    device.records.append(AttendanceRecord('9', datetime(2026, 1, 2, 18, 0)))
+    assert reconciler.check(device, 'TEST-RECONCILE') == ['2026-01-02']
+    assert reconciler.check(device, 'TEST-RECONCILE') == []
+    assert device.full_reads == 1
+    assert device.tail_reads == [0, 2, 2]
+    stored = db_handler.get_attendance_bucket_digests('TEST-RECONCILE', reconciler.sql_format)
+    assert stored == reconciler.device_digests(device)[0]
+
+def test_full_pass_repairs_from_the_first_mismatched_bucket(db_handler):
+    reconciler = Reconciler(db_handler, 'day')
+    db_handler.bulk_insert_attendance(RECORDS[:2], 'TEST-RECONCILE')
+    device = FakeReader(RECORDS)
+    assert reconciler.reconcile(device, 'TEST-RECONCILE') == ['2026-01-02']
+    assert device.full_reads == 1
+    assert device.tail_reads == [2]
+
+def test_replaced_log_falls_back_to_a_full_pass(db_handler):
+    reconciler = Reconciler(db_handler, 'day')
+    reconciler.check(FakeReader(RECORDS), 'TEST-RECONCILE')
+
+    device = FakeReader([AttendanceRecord('5', datetime(2026, 2, 1, 9, 0))])
+    assert reconciler.check(device, 'TEST-RECONCILE') == ['2026-02-01']
+    assert device.full_reads == 1
+
+def test_full_pass_runs_once_its_interval_has_passed(db_handler):
+    reconciler = Reconciler(db_handler, 'day', full_interval=0)
+    device = FakeReader(RECORDS)
+    reconciler.check(device, 'TEST-RECONCILE')
+    reconciler.check(device, 'TEST-RECONCILE')
+    assert device.full_reads == 2
+    assert device.tail_reads == [0]
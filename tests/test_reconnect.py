@@ -0,0 +1,56 @@
+import pytest
+import reconnect
+from reconnect import Backoff, CircuitBreaker
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(reconnect.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_backoff_is_jittered_within_each_step():
+    backoff = Backoff(1, 8)
+    for step in [1, 2, 4, 8, 8]:
+        assert step / 2 <= backoff.next() <= step
+
+def test_backoff_reset():
+    backoff = Backoff(1, 60)
+    for _ in range(4):
+        backoff.next()
+    backoff.reset()
+    assert backoff.next() <= 1
+
+def test_circuit_opens_after_threshold_failures(clock):
+    breaker = CircuitBreaker('dev', failure_threshold=3, cooldown=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.remaining() == 60
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker('dev', failure_threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+def test_half_open_trial_after_cooldown(clock):
+    breaker = CircuitBreaker('dev', failure_threshold=1, cooldown=60)
+    breaker.record_failure()
+    clock[0] += 60
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+
+    # A failed trial opens the circuit for another full cooldown
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.remaining() == 60
+
+    clock[0] += 60
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.remaining() == 0
@@ -0,0 +1,11 @@
+from sharding import shard_devices
+
+def test_round_robin():
+    assert shard_devices(list(range(7)), 3) == [[0, 3, 6], [1, 4], [2, 5]]
+
+def test_never_more_shards_than_devices():
+    assert shard_devices(['a', 'b'], 4) == [['a'], ['b']]
+
+def test_single_shard():
+    assert shard_devices(['a', 'b'], 1) == [['a', 'b']]
+    assert shard_devices([], 3) == [[]]
@@ -0,0 +1,158 @@
+import time
+from datetime import datetime
+import ingest
+from records import AttendanceRecord
+from ingest import IngestWriter
+from spool import Spool, stale_spools
+
+def events(*user_ids):
+    return [('DEV1', AttendanceRecord(user_id, datetime(2026, 1, 1, 8, 0, index))) for index, user_id in enumerate(user_ids)]
+
+def read_all(spool):
+    return [event for path in spool.segments() for event in spool.read(path)]
+
+def test_round_trip(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(events('1', '2'))
+    spool.append(events('3'))
+    assert read_all(spool) == events('1', '2') + events('3')
+    assert spool.pending()
+
+def test_skips_lines_that_fail_their_checksum(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(events('1'))
+    spool.append(events('2'))
+    spool.append(events('3'))
+    spool.seal()
+
+    path = spool.segments()[0]
+    lines = open(path, 'rb').read().split(b'\n')
+    lines[1] = lines[1].replace(b'"2"', b'"9"')
+    open(path, 'wb').write(b'\n'.join(lines))
+
+    assert read_all(spool) == events('1') + events('3')
+
+def test_skips_a_torn_last_line(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(events('1'))
+    spool.append(events('2'))
+    spool.seal()
+
+    path = spool.segments()[0]
+    data = open(path, 'rb').read()
+    open(path, 'wb').write(data[:-10])
+
+    assert read_all(spool) == events('1')
+
+def test_rolls_over_to_new_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=1)
+    for user_id in '123':
+        spool.append(events(user_id))
+    assert len(spool.segments()) == 3
+    assert read_all(spool) == events('1') + events('2') + events('3')
+
+def test_discard_forgets_everything(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=1)
+    spool.append(events('1'))
+    spool.append(events('2'))
+    spool.discard()
+    assert not spool.pending()
+    assert read_all(spool) == []
+
+def test_new_spool_continues_numbering(tmp_path):
+    Spool(str(tmp_path)).append(events('1'))
+    spool = Spool(str(tmp_path))
+    spool.append(events('2'))
+    assert len(spool.segments()) == 2
+
+def test_stale_spools_are_the_directories_no_worker_uses(tmp_path):
+    root = str(tmp_path)
+    for name in ('shard-0', 'shard-1', 'shard-2', 'other'):
+        (tmp_path / name).mkdir()
+
+    in_use = [f"{root}/shard-0", f"{root}/shard-1"]
+    assert [spool.directory for spool in stale_spools(in_use, root)] == [root, f"{root}/shard-2"]
+    assert [spool.directory for spool in stale_spools([root], root)] == [f"{root}/shard-{n}" for n in range(3)]
+
+class RecordingDatabase:
+    def __init__(self):
+        self.saved = []
+        self.failing = False
+
+    def save_attendance_events(self, events):
+        if self.failing:
+            return False
+        self.saved.extend(events)
+        return True
+
+def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_writer_flushes_a_full_batch_at_once(tmp_path):
+    db = RecordingDatabase()
+    writer = IngestWriter(db, batch_size=2, flush_interval=1, spool=Spool(str(tmp_path)))
+    writer.start()
+    for device_serial, record in events('1', '2', '3'):
+        writer.submit(record, device_serial)
+    assert wait_for(lambda: db.saved == events('1', '2'))
+
+    # The partial batch waits for its flush interval
+    time.sleep(0.2)
+    assert db.saved == events('1', '2')
+    writer.stop()
+    assert db.saved == events('1', '2', '3')
+
+def test_writer_flushes_a_partial_batch_after_the_interval(tmp_path):
+    db = RecordingDatabase()
+    writer = IngestWriter(db, batch_size=100, flush_interval=0.1, spool=Spool(str(tmp_path)))
+    writer.start()
+    writer.submit(events('1')[0][1], 'DEV1')
+    assert wait_for(lambda: db.saved == events('1'))
+    writer.stop()
+
+def test_failed_save_degrades_to_spooling_and_drains_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'SPOOL_RETRY_INTERVAL', 0.1)
+    db = RecordingDatabase()
+    db.failing = True
+    spool = Spool(str(tmp_path))
+    writer = IngestWriter(db, batch_size=1, flush_interval=0.05, spool=spool)
+    writer.start()
+
+    writer.submit(events('1')[0][1], 'DEV1')
+    assert wait_for(lambda: writer.degraded)
+    writer.submit(events('2')[0][1], 'DEV1')
+    assert wait_for(lambda: len(read_all(spool)) == 2)
+    assert db.saved == []
+    assert read_all(spool) == events('1') + events('2')
+
+    # Once the database is back the backlog goes first, then new events
+    db.failing = False
+    assert wait_for(lambda: not writer.degraded)
+    writer.submit(events('3')[0][1], 'DEV1')
+    assert wait_for(lambda: len(db.saved) == 3)
+    writer.stop()
+    assert [record.user_id for _, record in db.saved] == ['1', '2', '3']
+    assert not spool.pending()
+
+def test_writer_replays_leftover_spools_first(tmp_path):
+    leftover = Spool(str(tmp_path / 'shard-3'))
+    leftover.append(events('1'))
+    leftover.seal()
+    own = Spool(str(tmp_path / 'shard-0'))
+    own.append(events('2'))
+    own.seal()
+
+    db = RecordingDatabase()
+    writer = IngestWriter(db, spool=own, leftovers=[leftover])
+    writer.start()
+    for _ in range(100):
+        if not writer.degraded:
+            break
+        time.sleep(0.05)
+    writer.stop()
+    assert db.saved == events('1') + events('2')
+    assert not leftover.pending() and not own.pending()
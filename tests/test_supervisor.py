@@ -0,0 +1,14 @@
+from metrics import render
+from supervisor import DeviceSupervisor
+from zk_reader import ZKTecoReader
+
+class FakeWriter:
+    db_handler = None
+
+def test_device_states_are_published_as_metrics():
+    supervisor = DeviceSupervisor([ZKTecoReader('192.0.2.7', 4370)], FakeWriter())
+    assert 'zkt_device_state{device="192.0.2.7:4370",state="pending"} 1' in render()
+    assert 'zkt_device_state{device="192.0.2.7:4370",state="running"} 0' in render()
+
+    supervisor.states['192.0.2.7:4370']['state'] = 'running'
+    assert 'zkt_device_state{device="192.0.2.7:4370",state="running"} 1' in render()
@@ -0,0 +1,108 @@
+import random
+from datetime import datetime
+import pytest
+from zk_reader import ZKTecoReader
+from zk_simulator import SimulatedDevice, DeviceSimulator
+
+@pytest.fixture
+def device():
+    return SimulatedDevice('TST0000001', users=5, records=3)
+
+@pytest.fixture
+def reader(device):
+    for _ in range(20):
+        port = random.randint(20000, 40000)
+        simulator = DeviceSimulator(device, port=port)
+        try:
+            simulator.start()
+            break
+        except OSError:
+            simulator.stop()
+    reader = ZKTecoReader('127.0.0.1', port, ommit_ping=True)
+    assert reader.connect()
+    yield reader
+    reader.drop_connection(failed=False)
+    simulator.stop()
+
+def user_ids(records):
+    return [record.user_id for record in records]
+
+def test_tail_read_returns_only_new_records(device, reader):
+    assert len(reader.fetch_new_attendance_logs()) == 3
+    assert reader.fetch_new_attendance_logs() == []
+
+    new = [device.punch(notify=False) for _ in range(2)]
+    logs = reader.fetch_new_attendance_logs()
+    assert user_ids(logs) == [record[1] for record in new]
+    assert reader.last_record_count == 5
+
+def test_log_that_shrank_is_read_again(device, reader):
+    reader.fetch_new_attendance_logs()
+    device.clear_attendance()
+    device.punch(notify=False)
+    assert len(reader.fetch_new_attendance_logs()) == 1
+    assert reader.last_record_count == 1
+
+def test_log_cleared_and_refilled_past_the_old_count_is_read_again(device, reader):
+    reader.fetch_new_attendance_logs()
+    device.clear_attendance()
+    for _ in range(10):
+        device.punch(notify=False)
+
+    logs = reader.fetch_new_attendance_logs()
+    assert len(logs) == 10
+    assert reader.last_record_count == 10
+    assert reader.fetch_new_attendance_logs() == []
+
+def test_stream_remembers_the_last_record(device, reader):
+    chunks = list(reader.iter_attendance_chunks(chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert reader.last_record_count == 3
+    assert reader.last_record == chunks[-1][-1]
+
+    device.punch(user_id='2', timestamp=datetime(2026, 2, 1, 9, 0), notify=False)
+    assert user_ids(reader.fetch_new_attendance_logs()) == ['2']
+
+def test_attendance_tail_from_an_index(device, reader):
+    logs = reader.fetch_attendance_logs()
+    assert reader.fetch_attendance_tail(1) == logs[1:]
+    assert reader.fetch_attendance_tail(3) == []
+
+def test_resume_from_a_saved_count(device, reader):
+    stored = {record[:2] for record in reader.fetch_attendance_logs()}
+    is_stored = lambda record: record[:2] in stored
+    new = device.punch(notify=False)
+
+    fresh = ZKTecoReader(reader.ip, reader.port, ommit_ping=True)
+    fresh.conn = reader.conn
+    assert user_ids(fresh.resume(3, is_stored)) == [new[1]]
+    assert fresh.last_record_count == 4
+
+def test_resume_refuses_a_replaced_log(device, reader):
+    stored = {record[:2] for record in reader.fetch_attendance_logs()}
+    is_stored = lambda record: record[:2] in stored
+    device.clear_attendance()
+    for _ in range(5):
+        device.punch(notify=False)
+
+    assert reader.resume(3, is_stored) is None
+    assert reader.resume(0, is_stored) is None
+    assert reader.resume(6, is_stored) is None
+
+class RecordingDatabase:
+    def __init__(self):
+        self.synced = []
+
+    def sync_users(self, users):
+        self.synced.append(users)
+        return len(users), 0
+
+def test_users_are_synced_once_per_interval(device, reader):
+    db = RecordingDatabase()
+    reader.sync_users(db)
+    reader.sync_users(db)
+    assert [len(users) for users in db.synced] == [5]
+
+    reader.next_user_sync = 0
+    reader.sync_users(db)
+    assert len(db.synced) == 2
@@ -1,16 +1,67 @@
 from zk import ZK, const
 import logging
-from datetime import datetime
+import os
+import signal
+from struct import pack, unpack, iter_unpack
+from contextlib import contextmanager
 import time
-from config import DEVICES
+from config import (
+    DEVICES, MONITOR_MODE, METRICS_ENABLED, METRICS_PORT, STREAM_CHUNK_SIZE, RECONCILE_INTERVAL,
+    GAP_FILL_INTERVAL, SHARD_PROCESSES, SPOOL_ENABLED, SPOOL_DIR, LEASES_ENABLED, LEASE_RETRY_INTERVAL,
+    USER_SYNC_INTERVAL
+)
 from db import DatabaseHandler
+from records import AttendanceRecord
+from ingest import IngestWriter
+from spool import Spool, stale_spools
+from sharding import ShardSupervisor
+from polling import AdaptiveInterval
+from reconnect import Backoff, CircuitBreaker
+from leases import DeviceLeases, LeaseLost
+from bootstrap import DeviceBootstrap
+from partitions import PartitionManager
+from reconcile import Reconciler
+from metrics import DEVICE_READ_SECONDS, DEVICE_RECORDS, DEVICE_ERRORS, DEVICE_CIRCUIT_OPEN, LIVE_EVENTS, start_metrics_server
+from supervisor import DeviceSupervisor
+
+# pyzk sends the buffered-read command as a bare number
+CMD_PREPARE_BUFFER = 1503
+
+def decode_attendance(data, decode_time):
+    """AttendanceRecords for the whole 40-byte records in data; decode_time is pyzk's"""
+    whole = len(data) - len(data) % 40
+    return [
+        AttendanceRecord(
+            (user_id.split(b'\x00')[0]).decode(errors='ignore'),
+            decode_time(timestamp),
+            punch,
+            status,
+        )
+        for uid, user_id, status, timestamp, punch, space in iter_unpack('<H24sB4sB8s', data[:whole])
+    ]
 
 class ZKTecoReader:
-    def __init__(self, ip, port=4370):
+    def __init__(self, ip, port=4370, force_udp=False, ommit_ping=False, poll=None, leases=None):
         self.ip = ip
         self.port = port
-        self.zk = ZK(ip, port=port, timeout=5)
+        # Label for this device in metrics
+        self.address = f"{ip}:{port}"
+        self.zk = ZK(ip, port=port, timeout=5, force_udp=force_udp, ommit_ping=ommit_ping)
         self.conn = None
+        # Device log size seen by the last read, None until the first full read
+        self.last_record_count = None
+        # The record at index last_record_count - 1, re-read to notice a replaced log
+        self.last_record = None
+        # sync_users() does nothing before this monotonic time
+        self.next_user_sync = 0
+        self.poll_schedule = AdaptiveInterval.for_device(poll)
+        # Reconnect pacing: ensure_connected() refuses to try before next_attempt
+        self.backoff = Backoff()
+        self.breaker = CircuitBreaker(self.address)
+        self.next_attempt = 0
+        # Optional DeviceLeases; the device is only contacted while this node holds its lease
+        self.leases = leases
+        DEVICE_CIRCUIT_OPEN.labels(self.address).set_function(lambda: int(self.breaker.state == 'open'))
         
         # Setup logging
         logging.basicConfig(
@@ -35,39 +86,322 @@ class ZKTecoReader:
             self.conn.disconnect()
             self.logger.info("Disconnected from device")
 
+    def ensure_connected(self):
+        """Connect unless already connected, honoring the backoff, circuit breaker and lease"""
+        if self.conn:
+            return True
+        if time.monotonic() < self.next_attempt or not self.breaker.allow():
+            return False
+        if not self.acquire_lease():
+            self.next_attempt = time.monotonic() + LEASE_RETRY_INTERVAL
+            return False
+
+        if self.connect():
+            self.breaker.record_success()
+            self.backoff.reset()
+            self.next_attempt = 0
+            return True
+        self._schedule_reconnect()
+        return False
+
+    def drop_connection(self, failed=True):
+        """Close the connection without letting a dead socket raise"""
+        try:
+            self.disconnect()
+        except Exception as e:
+            self.logger.debug(f"Ignoring disconnect error for {self.address}: {str(e)}")
+        self.conn = None
+        if failed:
+            self._schedule_reconnect()
+
+    def reconnect_delay(self):
+        """Seconds until ensure_connected() will try the device again"""
+        return max(0, self.next_attempt - time.monotonic(), self.breaker.remaining())
+
+    def acquire_lease(self):
+        """Claim the device for this node; always True without leases"""
+        return self.leases is None or self.leases.acquire(self.address)
+
+    def holds_lease(self):
+        return self.leases is None or self.leases.holds(self.address)
+
+    def check_lease(self):
+        """Raise LeaseLost once another node may have taken the device over"""
+        if not self.holds_lease():
+            # The next owner reads on from here; catch up again if the lease comes back
+            self.last_record_count = None
+            self.last_record = None
+            raise LeaseLost(f"Lease for device {self.address} lost")
+
+    def _schedule_reconnect(self):
+        self.breaker.record_failure()
+        self.next_attempt = time.monotonic() + self.backoff.next()
+        if self.leases is not None and self.breaker.state == 'open':
+            # Let a node that can still reach the device take it over
+            self.leases.release(self.address)
+
     def get_attendance_logs(self):
         """Retrieve attendance logs from the device"""
         try:
+            return self.fetch_attendance_logs()
+        except Exception as e:
+            self.logger.error(f"Error getting attendance logs: {str(e)}")
+            return []
+
+    def fetch_attendance_logs(self):
+        """Retrieve the full attendance log, raising on device errors"""
+        with self._measure('attendance'):
             if not self.conn:
                 raise Exception("Device not connected")
 
-            # Get attendance
-            attendance = self.conn.get_attendance()
-            logs = []
-            
-            for record in attendance:
-                log = {
-                    'user_id': record.user_id,
-                    'timestamp': record.timestamp,
-                    'punch': record.punch,
-                    'status': record.status,
-                }
-                logs.append(log)
-            
+            logs = [record for records in self._attendance_buffers() for record in records]
+
+            self.last_record_count = len(logs)
+            self.last_record = logs[-1] if logs else None
+            DEVICE_RECORDS.labels(self.address).inc(len(logs))
             self.logger.info(f"Successfully retrieved {len(logs)} attendance records")
             return logs
 
+    def get_new_attendance_logs(self):
+        """Retrieve only the attendance records added since the previous read"""
+        try:
+            return self.fetch_new_attendance_logs()
         except Exception as e:
-            self.logger.error(f"Error getting attendance logs: {str(e)}")
+            self.logger.error(f"Error getting new attendance logs: {str(e)}")
             return []
 
+    def fetch_new_attendance_logs(self):
+        """Retrieve only new attendance records, raising on device errors"""
+        with self._measure('new_attendance'):
+            if not self.conn:
+                raise Exception("Device not connected")
+
+            self.conn.read_sizes()
+            total_count = self.conn.records
+            known_count = self.last_record_count
+
+            if known_count is None or total_count < known_count:
+                if known_count is not None:
+                    self.logger.info(f"Device log shrank from {known_count} to {total_count} records, re-reading it")
+                return self.fetch_attendance_logs()
+
+            # A log refilled to exactly the old count is only noticed once it grows again
+            if total_count == known_count:
+                return []
+
+            # Start one record early to check it is still the one read last time
+            anchored = known_count > 0 and self.last_record is not None
+            start = known_count - 1 if anchored else known_count
+            full_logs = None
+            try:
+                logs = self._read_attendance_tail(start, total_count)
+            except Exception as e:
+                self.logger.warning(f"Tail read failed, falling back to full read: {str(e)}")
+                logs = None
+
+            if logs is None:
+                full_logs = self.fetch_attendance_logs()
+                logs = full_logs[start:]
+            else:
+                DEVICE_RECORDS.labels(self.address).inc(len(logs))
+
+            if anchored:
+                if not logs or logs[0][:2] != self.last_record[:2]:
+                    self.logger.info(f"Device log no longer continues from record {known_count}, re-reading it")
+                    return full_logs if full_logs is not None else self.fetch_attendance_logs()
+                logs = logs[1:]
+
+            # The buffer may hold punches that arrived after read_sizes()
+            self.last_record_count = known_count + len(logs)
+            if logs:
+                self.last_record = logs[-1]
+            self.logger.info(f"Retrieved {len(logs)} new attendance records")
+            return logs
+
+    @contextmanager
+    def _measure(self, operation):
+        """Record how long a device read took and whether it failed"""
+        try:
+            with DEVICE_READ_SECONDS.labels(self.address, operation).time():
+                yield
+        except Exception:
+            DEVICE_ERRORS.labels(self.address, operation).inc()
+            raise
+
+    def fetch_record_count(self):
+        """Current number of records in the device's attendance log"""
+        if not self.conn:
+            raise Exception("Device not connected")
+        self.conn.read_sizes()
+        return self.conn.records
+
+    def iter_attendance_chunks(self, chunk_size=STREAM_CHUNK_SIZE):
+        """Yield the full attendance log in lists of up to chunk_size records"""
+        pending = []
+        streamed = 0
+        last_record = None
+        for records in self._attendance_buffers():
+            pending.extend(records)
+            streamed += len(records)
+            if records:
+                last_record = records[-1]
+            while len(pending) >= chunk_size:
+                chunk, pending = pending[:chunk_size], pending[chunk_size:]
+                DEVICE_RECORDS.labels(self.address).inc(len(chunk))
+                yield chunk
+        if pending:
+            DEVICE_RECORDS.labels(self.address).inc(len(pending))
+            yield pending
+
+        # Counted from the buffer, which may hold punches newer than total_count
+        self.last_record_count = streamed
+        self.last_record = last_record
+        self.logger.info(f"Successfully streamed {streamed} attendance records")
+
+    def _attendance_buffers(self):
+        """The full log as successive lists of records, decoded straight from the device buffer"""
+        total_count = self.fetch_record_count()
+        prepared = self._prepare_attendance_buffer(total_count) if total_count else None
+        if prepared is None:
+            # Empty logs and layouts that need the user table go through pyzk
+            return [AttendanceRecord.from_pyzk_list(self.conn.get_attendance())]
+        return self._iter_attendance_buffer(prepared, 0)
+
+    def iter_attendance_logs(self, chunk_size=STREAM_CHUNK_SIZE):
+        """Yield attendance records one at a time as they are downloaded"""
+        for chunk in self.iter_attendance_chunks(chunk_size):
+            yield from chunk
+
+    def resume(self, record_count, is_stored):
+        """Continue tail reads from a record count saved by an earlier run"""
+        with self._measure('new_attendance'):
+            total_count = self.fetch_record_count()
+            if not record_count or total_count < record_count:
+                return None
+
+            # The record before the saved position must already be stored, or the log changed since
+            logs = self._read_attendance_tail(record_count - 1, total_count)
+            if not logs or not is_stored(logs[0]):
+                return None
+
+            DEVICE_RECORDS.labels(self.address).inc(len(logs))
+            self.last_record_count = record_count - 1 + len(logs)
+            self.last_record = logs[-1]
+            self.logger.info(f"Resumed at record {record_count}, retrieved {len(logs) - 1} new attendance records")
+            return logs[1:]
+
+    def catch_up(self, db_handler, device_serial):
+        """Store everything the device logged since the position saved in its watermark"""
+        _, record_count = db_handler.get_device_watermark(device_serial, cached=False)
+        records = self.resume(record_count, lambda record: db_handler.has_attendance(device_serial, record))
+
+        if records is None:
+            record_count = self.fetch_record_count()
+            result = db_handler.save_attendance_stream(self.iter_attendance_chunks(), device_serial, record_count)
+            if result is None:
+                raise Exception("Attendance sync failed")
+            return sum(result)
+
+        if records and not db_handler.save_attendance(records, device_serial, record_count=self.last_record_count):
+            raise Exception("Attendance sync failed")
+        return len(records)
+
+    def fetch_attendance_tail(self, start):
+        """The records from log index start on, or None when the log layout needs a full read"""
+        with self._measure('attendance_tail'):
+            total_count = self.fetch_record_count()
+            if total_count <= start:
+                return []
+            logs = self._read_attendance_tail(start, total_count)
+            if logs is not None:
+                DEVICE_RECORDS.labels(self.address).inc(len(logs))
+            return logs
+
+    def _read_attendance_tail(self, known_count, total_count):
+        """Download only the records after known_count from the device buffer"""
+        prepared = self._prepare_attendance_buffer(total_count)
+        if prepared is None:
+            return None
+
+        logs = []
+        for records in self._iter_attendance_buffer(prepared, known_count):
+            logs.extend(records)
+        return logs
+
+    def _prepare_attendance_buffer(self, total_count):
+        """Ask the device to buffer its attendance log"""
+        # pyzk 0.9 internals; returns (inline_data, buffer_size), or None when the layout needs a full read
+        conn = self.conn
+        response = conn._ZK__send_command(
+            CMD_PREPARE_BUFFER, pack('<bhii', 1, const.CMD_ATTLOG_RRQ, 0, 0), 1024
+        )
+        if not response.get('status'):
+            return None
+
+        if response['code'] == const.CMD_DATA:
+            # Small logs come back inline with the prepare reply
+            data = conn._ZK__data
+            if conn.tcp and len(data) < conn._ZK__tcp_length - 8:
+                data += conn._ZK__recieve_raw_data(conn._ZK__tcp_length - 8 - len(data))
+            total_size = unpack('I', data[:4])[0]
+            prepared = (data, len(data))
+        else:
+            size = unpack('I', conn._ZK__data[1:5])[0]
+            total_size = unpack('I', conn._ZK__read_chunk(0, 4))[0]
+            prepared = (None, size)
+
+        # 8 and 16 byte layouts need the device user table to resolve ids
+        if total_size % total_count or total_size // total_count != 40:
+            if prepared[0] is None:
+                conn.free_data()
+            return None
+        return prepared
+
+    def _iter_attendance_buffer(self, prepared, skip_count):
+        """Yield decoded records per buffer chunk, starting after skip_count records"""
+        conn = self.conn
+        data, size = prepared
+        start = 4 + skip_count * 40
+
+        if data is not None:
+            yield self._decode_attendance(data[start:])
+            return
+
+        max_chunk = 0xFFc0 if conn.tcp else 16 * 1024
+        leftover = b''
+        try:
+            while start < size:
+                length = min(max_chunk, size - start)
+                chunk = leftover + conn._ZK__read_chunk(start, length)
+                start += length
+                # Chunks are not aligned to records; carry the partial one over
+                whole = len(chunk) - len(chunk) % 40
+                leftover = chunk[whole:]
+                yield self._decode_attendance(chunk[:whole])
+        finally:
+            conn.free_data()
+
+    def _decode_attendance(self, data):
+        return decode_attendance(data, self.conn._ZK__decode_time)
+
+    def sync_users(self, db_handler):
+        """Copy the device's users to the database once USER_SYNC_INTERVAL has passed"""
+        if time.monotonic() < self.next_user_sync:
+            return
+        # A failed sync is retried next interval rather than on every pass
+        self.next_user_sync = time.monotonic() + USER_SYNC_INTERVAL
+        users = self.get_users()
+        if users:
+            db_handler.sync_users(users)
+
     def get_users(self):
         """Retrieve user information from the device"""
         try:
             if not self.conn:
                 raise Exception("Device not connected")
 
-            users = self.conn.get_users()
+            with self._measure('users'):
+                users = self.conn.get_users()
             user_list = []
             
             for user in users:
@@ -136,25 +470,18 @@ class ZKTecoReader:
             # Print existing records
             print(f"\nExisting attendance records: {last_count}")
             for record in last_records[-5:]:  # Show last 5 records
-                print(f"User: {record['user_id']} - Time: {record['timestamp']} - Status: {record['status']}")
+                print(f"User: {record.user_id} - Time: {record.timestamp} - Status: {record.status}")
             
             # Monitor for new records
             while True:
                 time.sleep(2)  # Check every 2 seconds
-                current_records = self.get_attendance_logs()
-                current_count = len(current_records)
-                
-                if current_count > last_count:
-                    # New records found
-                    new_records = current_records[last_count:]
-                    for record in new_records:
-                        print("\n=== New Attendance Record ===")
-                        print(f"User ID: {record['user_id']}")
-                        print(f"Time: {record['timestamp']}")
-                        print(f"Status: {record['status']}")
-                        print("============================")
-                    
-                    last_count = current_count
+                new_records = self.get_new_attendance_logs()
+                for record in new_records:
+                    print("\n=== New Attendance Record ===")
+                    print(f"User ID: {record.user_id}")
+                    print(f"Time: {record.timestamp}")
+                    print(f"Status: {record.status}")
+                    print("============================")
 
         except KeyboardInterrupt:
             print("\nStopping attendance monitor...")
@@ -182,142 +509,218 @@ class ZKTecoReader:
             
             print(f"\nMonitoring device: {self.ip} (Serial: {device_serial})")
             
-            # Initial sync of users
-            users = self.get_users()
-            db_handler.sync_users(users)
-            
-            # Track last sync time
-            last_full_sync = datetime.now()
-            SYNC_INTERVAL = 30 * 60  # 30 minutes in seconds
+            # Pick up where the last run stopped reading
+            self.catch_up(db_handler, device_serial)
             
+            # Track last consistency check
+            reconciler = Reconciler(db_handler)
+            last_reconcile = time.monotonic()
+
             while True:
-                current_records = self.get_attendance_logs()
+                # Added, renamed and removed users reach the database between restarts too
+                self.sync_users(db_handler)
+
+                # Compare per-bucket digests and repair only the buckets that differ
+                if time.monotonic() - last_reconcile >= RECONCILE_INTERVAL:
+                    repaired = reconciler.check(self, device_serial)
+                    if repaired:
+                        self.logger.info(f"Reconciled {len(repaired)} buckets for device {device_serial}")
+                    last_reconcile = time.monotonic()
+
+                # Only records appended since the last read; stored ones are skipped by the database
+                current_records = self.get_new_attendance_logs()
+
                 if current_records:
-                    # Check for full sync every 30 minutes
-                    if (datetime.now() - last_full_sync).seconds >= SYNC_INTERVAL:
-                        db_count = db_handler.get_attendance_count_by_device(device_serial)
-                        device_count = len(current_records)
-                        
-                        self.logger.info(f"Periodic check for device {device_serial} - DB records: {db_count}, Device records: {device_count}")
-                        
-                        if db_count != device_count:
-                            self.logger.info(f"Database count mismatch for device {device_serial}. Performing full sync...")
-                            if db_handler.sync_device_records(current_records, device_serial):
-                                self.logger.info(f"Full sync completed successfully for device {device_serial}")
-                        
-                        last_full_sync = datetime.now()
-                    
-                    # Real-time monitoring
-                    latest_db_timestamp = db_handler.get_latest_attendance_timestamp()
-                    new_records = [
-                        record for record in current_records
-                        if latest_db_timestamp is None or record['timestamp'] > latest_db_timestamp
-                    ]
-                    
-                    if new_records:
-                        for record in new_records:
-                            if db_handler.save_attendance([record], device_serial):
-                                print(f"\nNew attendance: User {record['user_id']} at {record['timestamp']}")
+                    if db_handler.save_attendance(current_records, device_serial, record_count=self.last_record_count):
+                        for record in current_records:
+                            print(f"\nNew attendance: User {record.user_id} at {record.timestamp}")
                 
-                time.sleep(2)
+                time.sleep(self.poll_schedule.next(bool(current_records)))
 
         except Exception as e:
             self.logger.error(f"Error monitoring attendance: {str(e)}")
 
-    def monitor_live_capture_with_db(self, db_handler):
+    def monitor_live_capture_with_db(self, db_handler, writer=None):
         """Monitor live capture events and store in database"""
-        try:
-            if not self.conn:
-                raise Exception("Device not connected")
+        self._monitor_live(db_handler, writer, USER_SYNC_INTERVAL, "live events")
 
-            device_info = self.get_device_info()
-            device_serial = device_info if device_info else self.ip
-            
-            print(f"\nMonitoring live events from device: {self.ip} (Serial: {device_serial})")
-            
-            # Initial sync of users
-            users = self.get_users()
-            db_handler.sync_users(users)
+    def monitor_hybrid_with_db(self, db_handler, writer=None, gap_fill_interval=GAP_FILL_INTERVAL):
+        """Live capture for latency, with incremental tail reads to fill gaps"""
+        self._monitor_live(db_handler, writer, gap_fill_interval, "live events with gap filling")
 
-            # Enable real-time monitoring
-            self.conn.enable_device()
-            self.conn.cancel_capture()
-            self.conn.verify_user()
-            self.end_live_capture = False
-            
-            for event in self.conn.live_capture():
-                if event is None:  # timeout
-                    continue
-                if self.end_live_capture:
-                    break
-                    
-                # Convert event to record format
-                record = {
-                    'user_id': event.user_id,
-                    'timestamp': event.timestamp
-                }
-                
-                # Save to database
-                if db_handler.save_attendance([record], device_serial):
-                    print(f"\nLive event: User {record['user_id']} at {record['timestamp']}")
-                
-        except Exception as e:
-            self.logger.error(f"Error monitoring live events: {str(e)}")
+    def _monitor_live(self, db_handler, writer, pause_interval, description):
+        """Alternate gap fills, user syncs and consistency checks with live capture until end_live_capture"""
+        self.end_live_capture = False
+        device_serial = None
+        reconciler = Reconciler(db_handler)
+        next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+
+        try:
+            while self._wait_for_connection():
+                try:
+                    if device_serial is None:
+                        device_info = self.get_device_info()
+                        device_serial = device_info if device_info else self.ip
+                        print(f"\nMonitoring {description} from device: {self.ip} (Serial: {device_serial})")
+
+                    # Also catches up after a takeover from another node
+                    self._fill_gap(db_handler, writer, device_serial)
+                    self.sync_users(db_handler)
+                    if time.monotonic() >= next_reconcile:
+                        reconciler.check(self, device_serial)
+                        next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+                    deadline = min(time.monotonic() + pause_interval, self.next_user_sync, next_reconcile)
+                    self._capture_until(deadline, db_handler, writer, device_serial)
+                except LeaseLost as e:
+                    self.logger.warning(f"{str(e)}, standing by")
+                    self.drop_connection(failed=False)
+                except Exception as e:
+                    if self.end_live_capture:
+                        # main() closed the connection on shutdown
+                        break
+                    self.logger.error(f"Error monitoring device {self.address}, reconnecting: {str(e)}")
+                    self.drop_connection()
         finally:
             self.end_live_capture = True
 
-def main():
+    def _wait_for_connection(self):
+        """Block until connected (True) or until end_live_capture is set (False)"""
+        while not self.end_live_capture:
+            if self.ensure_connected():
+                return True
+            # Short naps so a stop request is noticed even during a long circuit cooldown
+            time.sleep(min(max(self.reconnect_delay(), 0.1), 1))
+        return False
+
+    def _fill_gap(self, db_handler, writer, device_serial):
+        """Store the records the device logged since the last read"""
+        self.check_lease()
+        if self.last_record_count is None:
+            # Nothing read yet (the startup sync failed): continue from the saved watermark
+            self.catch_up(db_handler, device_serial)
+            return
+
+        records = self.fetch_new_attendance_logs()
+        if not records:
+            return
+        self.logger.info(f"Gap fill found {len(records)} records on device {device_serial}")
+        if writer is not None:
+            for record in records:
+                writer.submit(record, device_serial)
+        elif not db_handler.save_attendance(records, device_serial, record_count=self.last_record_count):
+            raise Exception("Gap fill failed")
+
+    def _capture_until(self, deadline, db_handler, writer, device_serial):
+        """Consume live events until the deadline or end_live_capture"""
+        self.conn.end_live_capture = False
+        # The socket timeout bounds how late an idle capture notices the deadline
+        timeout = min(10, max(1, deadline - time.monotonic()))
+        for event in self.conn.live_capture(new_timeout=timeout):
+            if self.end_live_capture or time.monotonic() >= deadline:
+                # Let pyzk unregister the events and restore the socket before returning
+                self.conn.end_live_capture = True
+            if event is None:
+                self.check_lease()
+                continue
+            LIVE_EVENTS.labels(self.address).inc()
+
+            record = AttendanceRecord.from_pyzk(event)
+            if writer is not None:
+                writer.submit(record, device_serial)
+            elif db_handler.save_attendance([record], device_serial):
+                print(f"\nLive event: User {record.user_id} at {record.timestamp}")
+            self.check_lease()
+
+def run(devices, shard=None, shards=1):
+    """Sync and monitor the given devices in this process"""
+    if shard is not None:
+        logging.basicConfig(
+            level=logging.INFO,
+            format=f'%(asctime)s - shard {shard} - %(levelname)s - %(message)s'
+        )
+    # systemd stops the service with SIGTERM: shut down like Ctrl+C, so queued events are flushed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
     # Initialize database
     db_handler = DatabaseHandler()
     if not db_handler.connect():
         print("Failed to connect to database")
         return
+    # Upgraded installs may lack tables and columns added since they were created
+    if not db_handler.ensure_tables():
+        print("Failed to create database tables")
+        db_handler.disconnect()
+        return
 
+    if METRICS_ENABLED:
+        start_metrics_server(METRICS_PORT + (shard or 0))
+
+    writer = None
+    partitions = None
+    leases = None
+    readers = []
+    all_readers = []
     try:
-        readers = []
+        # With several nodes, each device is only worked on by the node holding its lease
+        if LEASES_ENABLED:
+            leases = DeviceLeases()
+            leases.start()
+
         # Initialize all devices
-        for device in DEVICES:
-            reader = ZKTecoReader(device['ip'], device['port'])
-            if reader.connect():
-                readers.append(reader)
-        
-        if not readers:
-            print("No devices connected!")
-            return
+        for device in devices:
+            reader = ZKTecoReader(
+                device['ip'], device['port'],
+                force_udp=device.get('force_udp', False),
+                ommit_ping=device.get('ommit_ping', False),
+                poll=device.get('poll'),
+                leases=leases
+            )
+            all_readers.append(reader)
 
-        # First sync all users from all devices
-        print("Performing initial sync of users from all devices...")
-        all_users = {}
-        for reader in readers:
-            device_info = reader.get_device_info()
-            print(f"Getting users from device: {device_info}")
-            users = reader.get_users()
-            for user in users:
-                all_users[user['user_id']] = user
+        # Connect, fetch users and download attendance from all devices in parallel
+        print("Performing initial sync of users and attendance from all devices...")
+        readers = DeviceBootstrap(all_readers, db_handler).run()
 
-        # Sync combined users to database
-        if all_users:
-            print(f"Syncing {len(all_users)} users to database...")
-            db_handler.sync_users(list(all_users.values()))
+        # On a partitioned schema, also moves history just loaded into the default partition
+        if not shard:
+            partitions = PartitionManager(db_handler)
+            partitions.start()
 
-        # Now start attendance sync
-        print("\nStarting attendance sync...")
-        for reader in readers:
-            device_info = reader.get_device_info()
-            print(f"Device: {device_info}")
-            device_serial = device_info if device_info else reader.ip
-            logs = reader.get_attendance_logs()
-            if logs:
-                db_handler.save_attendance(logs, device_serial)
+        if not readers:
+            print("No devices connected yet, retrying in the background")
+        # Monitors reconnect on their own, so devices that were down at startup are watched too
+        readers = all_readers
+
+        spool = None
+        leftovers = []
+        if SPOOL_ENABLED:
+            if shard is None:
+                spool_dirs = [SPOOL_DIR]
+            else:
+                spool_dirs = [os.path.join(SPOOL_DIR, f"shard-{index}") for index in range(shards)]
+            spool = Spool(spool_dirs[shard or 0])
+            # Spools of a different shard count or mode are replayed by a single worker
+            if not shard:
+                leftovers = stale_spools(spool_dirs, SPOOL_DIR)
+        writer = IngestWriter(db_handler, spool=spool, leftovers=leftovers)
+        writer.start()
+
+        if MONITOR_MODE == 'supervisor':
+            # Poll every device from one asyncio loop, retrying the ones that failed to connect
+            print(f"\nSupervising {len(all_readers)} devices. Press Ctrl+C to exit.")
+            supervisor = DeviceSupervisor(all_readers, writer)
+            supervisor.run()
+            return
 
         # Start live monitoring on all devices
         print("\nStarting live monitoring on all devices...")
         import threading
         threads = []
         for reader in readers:
+            monitor = reader.monitor_hybrid_with_db if MONITOR_MODE == 'hybrid' else reader.monitor_live_capture_with_db
             thread = threading.Thread(
-                target=reader.monitor_live_capture_with_db,
-                args=(db_handler,)
+                target=monitor,
+                args=(db_handler, writer)
             )
             thread.daemon = True
             thread.start()
@@ -335,8 +738,26 @@ def main():
     finally:
         # Clean up
         for reader in readers:
-            reader.conn.disconnect()
+            if reader.conn:
+                reader.conn.disconnect()
+        if writer:
+            writer.stop()
+        if partitions:
+            partitions.stop()
+        if leases:
+            leases.stop()
         db_handler.disconnect()
 
+def main():
+    if SHARD_PROCESSES > 1 and len(DEVICES) > 1:
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s'
+        )
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        ShardSupervisor(DEVICES, run).run()
+    else:
+        run(DEVICES)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,370 @@
+from zk import const
+import argparse
+import logging
+import random
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+from struct import pack, unpack
+
+# Buffered-read commands pyzk sends as bare numbers
+CMD_PREPARE_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+
+# Buffers up to this size are returned inline with the prepare reply
+INLINE_BUFFER_LIMIT = 1024
+UDP_PACKET_DATA = 1024
+EVENT_ACK_TIMEOUT = 1
+
+def encode_time(t):
+    """Pack a datetime the way the terminal stores it in attendance records"""
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+def checksum(packet):
+    """Packet checksum, same algorithm as zkemsdk.c and pyzk"""
+    total = 0
+    for i in range(0, len(packet) - 1, 2):
+        total += packet[i] | (packet[i + 1] << 8)
+        if total > const.USHRT_MAX:
+            total -= const.USHRT_MAX
+    if len(packet) % 2:
+        total += packet[-1]
+    while total > const.USHRT_MAX:
+        total -= const.USHRT_MAX
+    total = ~total
+    while total < 0:
+        total += const.USHRT_MAX
+    return total
+
+class SimulatedDevice:
+    """In-memory terminal: enrolled users plus an append-only attendance log"""
+
+    def __init__(self, serial='SIM0000001', users=100, records=0, start=None):
+        self.serial = serial
+        self.lock = threading.Lock()
+        # (uid, user_id, name, privilege, card)
+        self.users = [(uid, str(uid), f"Employee {uid}", 0, 0) for uid in range(1, users + 1)]
+        # (uid, user_id, timestamp, status, punch)
+        self.attendance = []
+        self.listeners = []
+        self.clock = start or datetime(2026, 1, 1, 8, 0, 0)
+        self.logger = logging.getLogger(__name__)
+
+        for _ in range(records):
+            self.punch(notify=False)
+
+    def punch(self, user_id=None, timestamp=None, notify=True):
+        """Append a punch to the log and push it to live-capture sessions"""
+        with self.lock:
+            if user_id is None:
+                uid, user_id = random.choice(self.users)[:2]
+            else:
+                uid = next((u[0] for u in self.users if u[1] == user_id), 0)
+            if timestamp is None:
+                # One second apart keeps every generated punch unique
+                self.clock += timedelta(seconds=1)
+                timestamp = self.clock
+            record = (uid, user_id, timestamp, 1, 0)
+            self.attendance.append(record)
+            listeners = list(self.listeners) if notify else []
+
+        for listener in listeners:
+            listener(record)
+        return record
+
+    def clear_attendance(self):
+        with self.lock:
+            self.attendance = []
+
+    def sizes(self):
+        """CMD_GET_FREE_SIZES payload"""
+        with self.lock:
+            fields = [0] * 20
+            fields[4] = len(self.users)
+            fields[8] = len(self.attendance)
+            fields[15] = 10000
+            fields[16] = 1000000
+        return pack('20i', *fields) + pack('3i', 0, 0, 0)
+
+    def users_buffer(self):
+        """72-byte user records as served for CMD_USERTEMP_RRQ"""
+        with self.lock:
+            data = b''.join(
+                pack('<HB8s24sIx7sx24s', uid, privilege, b'', name.encode(), card, b'', user_id.encode())
+                for uid, user_id, name, privilege, card in self.users
+            )
+        return pack('I', len(data)) + data
+
+    def attendance_buffer(self):
+        """40-byte attendance records as served for CMD_ATTLOG_RRQ"""
+        with self.lock:
+            data = b''.join(
+                pack('<H24sB4sB8s', uid, user_id.encode(), status, pack('<I', encode_time(timestamp)), punch, b'')
+                for uid, user_id, timestamp, status, punch in self.attendance
+            )
+        return pack('I', len(data)) + data
+
+class DeviceSession:
+    """Protocol state for one client connection (TCP stream or UDP peer)"""
+
+    def __init__(self, device, send, tcp):
+        self.device = device
+        self.send = send
+        self.tcp = tcp
+        self.session_id = random.randint(1, 0xFFFF)
+        self.buffer = b''
+        self.live = False
+        self.send_lock = threading.Lock()
+        self.event_acked = threading.Event()
+
+    def close(self):
+        self.stop_live()
+
+    def handle(self, packet):
+        command, _, _, reply_id = unpack('<4H', packet[:8])
+        data = packet[8:]
+
+        if command == const.CMD_ACK_OK:
+            # Client acknowledging a live event
+            self.event_acked.set()
+            return
+        if command == const.CMD_CONNECT:
+            self.reply(const.CMD_ACK_OK, reply_id)
+        elif command == const.CMD_EXIT:
+            self.stop_live()
+            self.reply(const.CMD_ACK_OK, reply_id)
+        elif command == const.CMD_OPTIONS_RRQ:
+            key = data.split(b'\x00')[0]
+            if key == b'~SerialNumber':
+                self.reply(const.CMD_ACK_OK, reply_id, key + b'=' + self.device.serial.encode() + b'\x00')
+            else:
+                self.reply(const.CMD_ACK_OK, reply_id, key + b'=\x00')
+        elif command == const.CMD_GET_FREE_SIZES:
+            self.reply(const.CMD_ACK_OK, reply_id, self.device.sizes())
+        elif command == CMD_PREPARE_BUFFER:
+            self.prepare_buffer(reply_id, data)
+        elif command == CMD_READ_BUFFER:
+            start, size = unpack('<ii', data[:8])
+            self.send_chunk(reply_id, self.buffer[start:start + size])
+        elif command == const.CMD_FREE_DATA:
+            self.buffer = b''
+            self.reply(const.CMD_ACK_OK, reply_id)
+        elif command == const.CMD_CLEAR_ATTLOG:
+            self.device.clear_attendance()
+            self.reply(const.CMD_ACK_OK, reply_id)
+        elif command == const.CMD_REG_EVENT:
+            flags = unpack('I', data[:4])[0] if len(data) >= 4 else 0
+            # Acknowledge before any event can be pushed on this session
+            self.reply(const.CMD_ACK_OK, reply_id)
+            if flags & const.EF_ATTLOG:
+                self.start_live()
+            else:
+                self.stop_live()
+        else:
+            # Enable/disable, verify, cancel capture and friends only need an ack
+            self.reply(const.CMD_ACK_OK, reply_id)
+
+    def prepare_buffer(self, reply_id, data):
+        _, command, _, _ = unpack('<bhii', data[:11])
+        if command == const.CMD_USERTEMP_RRQ:
+            self.buffer = self.device.users_buffer()
+        elif command == const.CMD_ATTLOG_RRQ:
+            self.buffer = self.device.attendance_buffer()
+        else:
+            self.buffer = b''
+
+        if len(self.buffer) <= INLINE_BUFFER_LIMIT:
+            self.reply(const.CMD_DATA, reply_id, self.buffer)
+        else:
+            self.reply(const.CMD_ACK_OK, reply_id, b'\x00' + pack('I', len(self.buffer)) + b'\x00' * 4)
+
+    def send_chunk(self, reply_id, chunk):
+        if self.tcp:
+            self.reply(const.CMD_DATA, reply_id, chunk)
+            return
+
+        # UDP chunks are announced, streamed in 1 KB datagrams, then acked
+        packets = [self.packet(const.CMD_PREPARE_DATA, reply_id, pack('I', len(chunk)))]
+        for offset in range(0, len(chunk), UDP_PACKET_DATA):
+            packets.append(self.packet(const.CMD_DATA, reply_id, chunk[offset:offset + UDP_PACKET_DATA]))
+        packets.append(self.packet(const.CMD_ACK_OK, reply_id))
+        with self.send_lock:
+            for packet in packets:
+                self.send(packet)
+
+    def start_live(self):
+        if not self.live:
+            self.live = True
+            with self.device.lock:
+                self.device.listeners.append(self.push_event)
+
+    def stop_live(self):
+        if self.live:
+            self.live = False
+            with self.device.lock:
+                if self.push_event in self.device.listeners:
+                    self.device.listeners.remove(self.push_event)
+
+    def push_event(self, record):
+        _, user_id, timestamp, status, punch = record
+        timehex = pack('6B', timestamp.year - 2000, timestamp.month, timestamp.day,
+                       timestamp.hour, timestamp.minute, timestamp.second)
+        payload = pack('<24sBB6s', user_id.encode(), status, punch, timehex)
+        # Like a terminal, wait for the ack before pushing the next event so
+        # events never coalesce into one TCP read on the client
+        self.event_acked.clear()
+        try:
+            self.reply(const.CMD_REG_EVENT, 0, payload)
+        except OSError:
+            self.stop_live()
+            return
+        self.event_acked.wait(EVENT_ACK_TIMEOUT)
+
+    def packet(self, code, reply_id, payload=b''):
+        header = pack('<4H', code, 0, self.session_id, reply_id) + payload
+        return pack('<4H', code, checksum(header), self.session_id, reply_id) + payload
+
+    def reply(self, code, reply_id, payload=b''):
+        with self.send_lock:
+            self.send(self.packet(code, reply_id, payload))
+
+class _TCPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+
+        def send(packet):
+            sock.sendall(pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(packet)) + packet)
+
+        session = DeviceSession(self.server.device, send, tcp=True)
+        self.server.connections.add(sock)
+        try:
+            while True:
+                top = self._recv_exact(8)
+                if top is None:
+                    break
+                _, _, length = unpack('<HHI', top)
+                packet = self._recv_exact(length)
+                if packet is None:
+                    break
+                session.handle(packet)
+        except OSError:
+            pass
+        finally:
+            self.server.connections.discard(sock)
+            session.close()
+
+    def _recv_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+class _UDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        packet, sock = self.request
+        sessions = self.server.sessions
+        with self.server.sessions_lock:
+            session = sessions.get(self.client_address)
+            if session is None or unpack('<H', packet[:2])[0] == const.CMD_CONNECT:
+                address = self.client_address
+                session = DeviceSession(self.server.device, lambda data: sock.sendto(data, address), tcp=False)
+                sessions[address] = session
+        session.handle(packet)
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _ThreadingUDPServer(socketserver.ThreadingUDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class DeviceSimulator:
+    """Serves a SimulatedDevice over the ZK protocol on TCP and UDP"""
+
+    def __init__(self, device, host='127.0.0.1', port=4370):
+        self.device = device
+        self.host = host
+        self.port = port
+        self.servers = []
+        self.punch_thread = None
+        self.stopping = threading.Event()
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        for server_class, handler in ((_ThreadingTCPServer, _TCPHandler), (_ThreadingUDPServer, _UDPHandler)):
+            server = server_class((self.host, self.port), handler)
+            server.device = self.device
+            server.sessions = {}
+            server.sessions_lock = threading.Lock()
+            server.connections = set()
+            thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.1})
+            thread.daemon = True
+            thread.start()
+            self.servers.append(server)
+        self.logger.info(f"Simulated device {self.device.serial} listening on {self.host}:{self.port}")
+
+    def start_punching(self, rate):
+        """Generate punches at roughly `rate` per second with Poisson arrivals"""
+        def run():
+            while not self.stopping.wait(random.expovariate(rate)):
+                self.device.punch()
+
+        self.punch_thread = threading.Thread(target=run)
+        self.punch_thread.daemon = True
+        self.punch_thread.start()
+
+    def stop(self):
+        """Stop serving and drop open connections, like a terminal rebooting"""
+        self.stopping.set()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+            for sock in list(server.connections):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.servers = []
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Run simulated ZKTeco terminals for local testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4370, help="port of the first device, others follow")
+    parser.add_argument('--devices', type=int, default=1)
+    parser.add_argument('--users', type=int, default=100, help="enrolled users per device")
+    parser.add_argument('--records', type=int, default=1000, help="attendance records preloaded per device")
+    parser.add_argument('--rate', type=float, default=0, help="new punches per second per device")
+    args = parser.parse_args()
+
+    simulators = []
+    for index in range(args.devices):
+        device = SimulatedDevice(f"SIM{index + 1:07d}", users=args.users, records=args.records)
+        simulator = DeviceSimulator(device, args.host, args.port + index)
+        simulator.start()
+        if args.rate:
+            simulator.start_punching(args.rate)
+        simulators.append(simulator)
+
+    print("Simulating devices. Press Ctrl+C to exit.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for simulator in simulators:
+            simulator.stop()
+
+if __name__ == "__main__":
+    main()